@@ -1,5 +1,5 @@
 import json
-from structure_patient_info import read_master_template, map_patient_data_to_template
+from structure_patient_info import read_compiled_template, map_patient_data_to_template
 from extract_neuropsych_form import extract_pdf_form_data
 import os
 
@@ -8,7 +8,7 @@ PATIENTS_DIR = '../../data/np_hx/patients'
 TEMPLATE_PATH = '../mapping/field_to_section_map.json'
 
 # Read the template once
-template_structure = read_master_template(TEMPLATE_PATH)
+template_structure = read_compiled_template(TEMPLATE_PATH)
 
 # Collect all mapped patient data
 all_patients_data = []
@@ -2,12 +2,98 @@
 # This is a support / utility function file.
 # Ideally we'd structure this to be a larger module for use across multiple projects
 # ------------------------------------------
-from pdfrw import PdfReader
+from pdfrw import PdfReader, PdfString, PdfArray
+from pdfrw.objects.pdfname import BasePdfName
+import re
 import pdb
 
-def extract_pdf_form_data(pdf_path):
+# Checkbox/radio values that mean "not selected"
+UNCHECKED_VALUES = {"Off"}
+_NAME_ESCAPE_RE = re.compile(r"#([0-9A-Fa-f]{2})")
+
+def decode_pdf_value(value):
+    """
+    Converts a raw /V value into text: string escapes and UTF-16 strings are decoded,
+    checkbox/radio names lose their leading slash (/Yes -> "Yes"), unchecked boxes (/Off) become None.
+    """
+    if value is None:
+        return None
+    if isinstance(value, PdfString):
+        return value.decode()
+    if isinstance(value, BasePdfName):
+        name = _NAME_ESCAPE_RE.sub(lambda m: chr(int(m.group(1), 16)), value[1:])
+        return None if name in UNCHECKED_VALUES else name
+    if isinstance(value, (PdfArray, list)):  # Multi-select list boxes
+        items = [item for item in (decode_pdf_value(v) for v in value) if item]
+        return ", ".join(items) or None
+    return str(value)
+
+def load_pdf(source):
+    """
+    Opens a PDF given as a path, raw bytes, a file object or an already opened PdfReader.
+    Bytes and buffers are parsed in memory (uploads never touch the disk).
+    """
+    if isinstance(source, PdfReader):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return PdfReader(fdata=bytes(source))
+    if hasattr(source, "read"):
+        return PdfReader(fdata=source.read())
+    return PdfReader(source)
+
+def extract_acroform_fields(pdf_path, fields=None):
+    """
+    Fast path: reads only the /AcroForm field tree instead of every page's /Annots.
+    pdfrw resolves objects lazily, so page content is never loaded.
+
+    Args:
+        pdf_path: Path, bytes, file object or PdfReader of the PDF (see load_pdf).
+        fields (iterable): Only collect these field names and stop as soon as all of them were seen.
+
+    Returns:
+        dict: {field name: value} for filled fields, or None if the PDF has no AcroForm.
+    """
+    pdf = load_pdf(pdf_path)
+    acroform = pdf.Root.AcroForm if pdf.Root else None
+    if not acroform or not acroform.Fields:
+        return None
+
+    remaining = set(fields) if fields is not None else None
+    form_data = {}
+    stack = list(reversed(acroform.Fields))
+
+    while stack:
+        field = stack.pop()
+        kids = field.Kids
+        # Non-terminal field: its kids carry their own names (kids without /T are just widgets)
+        if kids and any(kid.T is not None for kid in kids):
+            stack.extend(reversed(kids))
+            continue
+
+        if field.T is None:
+            continue
+        name = decode_pdf_value(field.T)
+        if remaining is not None:
+            if name not in remaining:
+                continue
+            remaining.discard(name)
+
+        value = decode_pdf_value(field.V)
+        if value:
+            form_data[name] = value
+
+        if remaining is not None and not remaining:
+            break  # Every requested field was found
+
+    return form_data
+
+def extract_annotation_fields(pdf_path, fields=None):
+    """
+    Slow path for PDFs without an /AcroForm: walks the /Annots of every page.
+    """
     # Read the PDF file
-    pdf = PdfReader(pdf_path)
+    pdf = load_pdf(pdf_path)
+    wanted = set(fields) if fields is not None else None
 
     # Initialize a dictionary to store form field names and their values
     form_data = {}
@@ -18,38 +104,44 @@ def extract_pdf_form_data(pdf_path):
         if annotations:
             for annotation in annotations:
                 field = annotation.get('/T')
-                value = annotation.get('/V')
+                value = decode_pdf_value(annotation.get('/V'))
                 if field and value:
-                    form_data[field[1:-1]] = value[1:-1]  # Remove leading/trailing brackets
+                    name = decode_pdf_value(field)
+                    if wanted is None or name in wanted:
+                        form_data[name] = value
+
+    return form_data
 
+def extract_pdf_form_data(pdf_path, fields=None):
+    pdf = load_pdf(pdf_path)  # Parsed once, even when falling back to the /Annots walk
+    form_data = extract_acroform_fields(pdf, fields)
+    if form_data is None:
+        form_data = extract_annotation_fields(pdf, fields)
     return form_data
     
-import json
+import os
+import sys
 
-# Load mapping from the JSON file
-def load_field_to_section_map(path='field_to_section_map.json'):
-    with open(path, 'r') as file:
-        return json.load(file)
+# The compiled mapping module is shared with the other projects under src/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mapping'))
+from compiled_mapping import CompiledMapping, compile_mapping, get_compiled_mapping
 
-# Invert the mapping to map field names back to section
-def invert_mapping(section_map):
-    return {
-        field: section
-        for section, fields in section_map.items()
-        for field in fields
-    }
+# Load the compiled mapping (field -> sections index) built from the JSON file, once per process
+def load_field_to_section_map(path='field_to_section_map.json'):
+    return get_compiled_mapping(path)
 
 # Extract a specific section from filled_values
 def extract_specific_section(filled_values, target_section, section_map):    
+    if isinstance(section_map, CompiledMapping):
+        return section_map.split(filled_values, [target_section])[target_section]
     return {
         key: filled_values[key]
         for key in section_map.get(target_section, [])
         if key in filled_values
     }
 
-# Extract all relevant sections
+# Extract all relevant sections in one pass over the filled fields
 def extract_sections(filled_values, target_sections, section_map):
-    extracted = {}
-    for section in target_sections:
-        extracted[section] = extract_specific_section(filled_values, section, section_map)
-    return extracted
\ No newline at end of file
+    if not isinstance(section_map, CompiledMapping):
+        section_map = compile_mapping(section_map)  # Plain {section: [fields]} dict
+    return section_map.split(filled_values, target_sections)
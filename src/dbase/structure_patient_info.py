@@ -1,27 +1,25 @@
 # ------------------------------------------
 # This is a support / utility function file
 # ------------------------------------------
+import os
+import sys
 import json
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mapping'))
+from compiled_mapping import CompiledMapping, compile_mapping, get_compiled_mapping
+
 # Function to read the master template from a JSON file
 def read_master_template(file_path):
     with open(file_path, 'r') as f:
         return json.load(f)
 
+# Function to read the compiled master template (field -> sections index), once per process
+def read_compiled_template(file_path):
+    return get_compiled_mapping(file_path)
+
 # Function to map patient data to template
+# Every template field is present in the result; fields without patient data are None
 def map_patient_data_to_template(patient_data, template):
-    mapped_data = {}
-
-    for section, fields in template.items():
-        mapped_section = {}
-        
-        for field in fields:
-            # If the field exists in the patient_data dictionary, map it
-            if field in patient_data:
-                mapped_section[field] = patient_data[field]
-            else:
-                mapped_section[field] = None  # Assign None or an empty string if no data exists
-
-        mapped_data[section] = mapped_section
-    
-    return mapped_data
\ No newline at end of file
+    if not isinstance(template, CompiledMapping):
+        template = compile_mapping(template)
+    return template.map_to_template(patient_data)
@@ -0,0 +1,142 @@
+# ------------------------------------------------------------
+# Compiled form of field_to_section_map.json, shared by reports/ and dbase/.
+# The JSON maps report sections to form fields. For splitting a form we need the opposite
+# direction, so the compiled artifact holds:
+#   - section_fields: {section: (field, ...)} in mapping order
+#   - field_index:    {field: ((section, position), ...)} - the inverted index
+# It is built once (and saved next to the JSON as a pickle keyed by the JSON's hash),
+# then loaded once per worker process.
+# ------------------------------------------------------------
+import os
+import json
+import pickle
+import hashlib
+import functools
+
+MAPPING_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SOURCE = os.path.join(MAPPING_DIR, "field_to_section_map.json")
+COMPILED_SUFFIX = ".compiled.pickle"
+
+
+class CompiledMapping:
+    def __init__(self, section_fields, field_index, source_hash=None):
+        self.section_fields = section_fields
+        self.field_index = field_index
+        self.source_hash = source_hash
+
+    def sections_for(self, field):
+        return tuple(section for section, _ in self.field_index.get(field, ()))
+
+    def split(self, filled_values, target_sections=None):
+        """
+        Splits a form into sections in one pass over its filled fields.
+        Fields keep the order they have in the mapping, as the per-section scan used to produce.
+
+        Returns:
+            dict: {section: {field: value}} for every target section (empty dict if nothing was filled).
+        """
+        targets = list(target_sections) if target_sections is not None else list(self.section_fields)
+        wanted = set(targets)
+        buckets = {section: [] for section in targets}
+        for field, value in filled_values.items():
+            for section, position in self.field_index.get(field, ()):
+                if section in wanted:
+                    buckets[section].append((position, field, value))
+        return {
+            section: {field: value for _, field, value in sorted(bucket, key=lambda item: item[0])}
+            for section, bucket in buckets.items()
+        }
+
+    def map_to_template(self, patient_data):
+        """
+        Every section with every mapped field; fields missing from patient_data are None.
+        """
+        mapped = {section: dict.fromkeys(fields) for section, fields in self.section_fields.items()}
+        for field, value in patient_data.items():
+            for section, _ in self.field_index.get(field, ()):
+                mapped[section][field] = value
+        return mapped
+
+    def to_dict(self):
+        return {section: list(fields) for section, fields in self.section_fields.items()}
+
+
+def compile_mapping(section_map, source_hash=None):
+    """
+    Args:
+        section_map (dict): {section: [field, ...]} as in field_to_section_map.json or
+            as returned by form_to_json.process_spreadsheet_to_json.
+    """
+    section_fields = {section: tuple(dict.fromkeys(fields)) for section, fields in section_map.items()}
+    field_index = {}
+    for section, fields in section_fields.items():
+        for position, field in enumerate(fields):
+            field_index.setdefault(field, []).append((section, position))
+    field_index = {field: tuple(entries) for field, entries in field_index.items()}
+    return CompiledMapping(section_fields, field_index, source_hash)
+
+
+def _source_hash(source_path):
+    with open(source_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def compiled_path_for(source_path):
+    return os.path.splitext(source_path)[0] + COMPILED_SUFFIX
+
+
+def save_compiled_mapping(mapping, output_path):
+    # Plain containers only, so the artifact does not depend on this module's class layout
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump({
+            "source_hash": mapping.source_hash,
+            "section_fields": mapping.section_fields,
+            "field_index": mapping.field_index,
+        }, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, output_path)
+
+
+def build_compiled_mapping(source_path=DEFAULT_SOURCE, output_path=None):
+    """
+    Compiles the JSON mapping and writes the artifact next to it.
+    """
+    with open(source_path, "r") as f:
+        mapping = compile_mapping(json.load(f), _source_hash(source_path))
+    save_compiled_mapping(mapping, output_path or compiled_path_for(source_path))
+    return mapping
+
+
+def load_compiled_mapping(source_path=DEFAULT_SOURCE):
+    """
+    Loads the compiled artifact, rebuilding it when it is missing or older than the JSON.
+    """
+    source_path = os.path.abspath(source_path)
+    artifact = compiled_path_for(source_path)
+    source_hash = _source_hash(source_path)
+    if os.path.exists(artifact):
+        try:
+            with open(artifact, "rb") as f:
+                data = pickle.load(f)
+            if data.get("source_hash") == source_hash:
+                return CompiledMapping(data["section_fields"], data["field_index"], source_hash)
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError) as e:
+            print(f"⚠️ Rebuilding unreadable compiled mapping {artifact}: {e}")
+    try:
+        return build_compiled_mapping(source_path, artifact)
+    except OSError:
+        # Read-only checkout: compile in memory only
+        with open(source_path, "r") as f:
+            return compile_mapping(json.load(f), source_hash)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_compiled_mapping(source_path):
+    return load_compiled_mapping(source_path)
+
+
+def get_compiled_mapping(source_path=DEFAULT_SOURCE):
+    """
+    Compiled mapping for this process (loaded once, then served from memory).
+    """
+    return _get_compiled_mapping(os.path.abspath(source_path))
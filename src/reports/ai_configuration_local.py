@@ -1,5 +1,14 @@
+import os
+import time
+import threading
 import requests
 import json
+from response_cache import get_cached_response, store_response
+from llm_limiter import llm_slot
+from long_inputs import CONTEXT_TOKENS
+from llm_usage import record_usage, record_prefix
+from ai_instructions import split_ai_instruction
+from llm_errors import LLMRequestError, TIMEOUT, CONNECTION, HTTP, DEADLINE, remaining_time
 
 # Setup local coding models to use
 # local_coding_model = "codegemma"
@@ -8,10 +17,183 @@ import json
 local_summary_model = "gpt-oss:20b"
 # local_coding_model = "qwen2.5-coder:32b"
 
+# How long Ollama keeps the weights resident after the last request (e.g. "30m", "-1" to pin forever)
+LOCAL_KEEP_ALIVE = os.getenv("NHORA_OLLAMA_KEEP_ALIVE", "30m")
+
+# Ollama endpoint and HTTP timeouts (seconds)
+OLLAMA_URL = os.getenv("NHORA_OLLAMA_URL", "http://127.0.0.1:11434/api/generate")
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("NHORA_OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("NHORA_OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_LOAD_TIMEOUT = float(os.getenv("NHORA_OLLAMA_LOAD_TIMEOUT", "600"))  # Cold loads of large models are slow
+# Context window requested from Ollama; every request uses the same value so the model is never reloaded.
+# Long inputs are chunked to fit it (see long_inputs.py).
+OLLAMA_NUM_CTX = CONTEXT_TOKENS["local"]
+OLLAMA_POOL_SIZE = 8  # Keep-alive connections per process (>= section threads)
+
+# Prime each static prompt prefix once and send only the patient payload with the returned `context`
+REUSE_OLLAMA_CONTEXT = os.getenv("NHORA_OLLAMA_REUSE_CONTEXT", "0") == "1"
+
+# ----------------------------
+# Pooled HTTP Session
+# ----------------------------
+_http_session = None
+_http_session_pid = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """
+    Returns the keep-alive connection pool shared by every thread of this process.
+    A new pool is created after a fork so processes never share sockets.
+    """
+    global _http_session, _http_session_pid
+    with _http_session_lock:
+        if _http_session is None or _http_session_pid != os.getpid():
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=OLLAMA_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({"Content-Type": "application/json"})
+            _http_session, _http_session_pid = session, os.getpid()
+        return _http_session
+
+def post_ollama(payload, deadline=None, read_timeout=OLLAMA_READ_TIMEOUT, stream=False):
+    """
+    POSTs to Ollama through the pooled session. The read timeout is shortened to whatever is
+    left of the deadline, and every transport failure is raised as an LLMRequestError.
+    """
+    remaining = remaining_time(deadline, "local")
+    if remaining is not None and remaining < read_timeout:
+        read_timeout, timeout_kind = remaining, DEADLINE
+    else:
+        timeout_kind = TIMEOUT
+    try:
+        response = get_http_session().post(
+            OLLAMA_URL,
+            data=json.dumps(payload),
+            timeout=(OLLAMA_CONNECT_TIMEOUT, read_timeout),
+            stream=stream
+        )
+        response.raise_for_status()
+        return response
+    except requests.exceptions.Timeout as e:
+        raise LLMRequestError(timeout_kind, f"No response from Ollama within {read_timeout:.0f}s: {e}", "local") from e
+    except requests.exceptions.ConnectionError as e:
+        raise LLMRequestError(CONNECTION, f"Could not reach Ollama at {OLLAMA_URL}: {e}", "local") from e
+    except requests.exceptions.HTTPError as e:
+        raise LLMRequestError(HTTP, f"Ollama returned {e.response.status_code}: {e.response.text[:200]}", "local") from e
+
+# ----------------------------
+# Local Model Session
+# ----------------------------
+class LocalModelSession:
+    """
+    Loads an Ollama model once and keeps it resident for a whole batch.
+
+    Every request carries the same keep_alive so the weights are never unloaded between
+    sections. /api/generate is stateless unless a `context` is passed back in, so a context
+    reset only drops what this session has stored - the model itself stays loaded.
+
+    With reuse_context, the `context` Ollama returns for each static prompt prefix is kept
+    for the whole batch, so later calls only prefill the patient payload. Prefix and payload are
+    both sent raw (no chat template), so the model sees exactly prefix + payload, one prompt.
+    """
+
+    def __init__(self, model=local_summary_model, keep_alive=LOCAL_KEEP_ALIVE, reuse_context=REUSE_OLLAMA_CONTEXT):
+        self.model = model
+        self.keep_alive = keep_alive
+        self.reuse_context = reuse_context
+        self.prefix_contexts = {}
+        self.load_seconds = None
+        self._lock = threading.Lock()
+        self._context_lock = threading.Lock()  # Guards prefix_contexts and _prefix_locks only
+        self._prefix_locks = {}
+
+    def load(self):
+        # Only one thread per process pays for the load; the others wait for it here
+        with self._lock:
+            if self.load_seconds is None:
+                start = time.time()
+                load_ai_model(self.model, keep_alive=self.keep_alive)
+                self.load_seconds = time.time() - start
+        return self.load_seconds
+
+    def generate(self, prompt, response_format=None, deadline=None, context=None, raw=False):
+        self.load()
+        return query_ollama_model(prompt, model=self.model, response_format=response_format, keep_alive=self.keep_alive, deadline=deadline, context=context, raw=raw)
+
+    def prefix_context(self, prefix, deadline=None):
+        """
+        Returns the Ollama context for a static prefix, evaluating the prefix only the first time.
+        Threads priming the same prefix wait for each other; other prefixes are primed concurrently.
+        """
+        with self._context_lock:
+            if prefix in self.prefix_contexts:
+                return self.prefix_contexts[prefix]
+            prefix_lock = self._prefix_locks.setdefault(prefix, threading.Lock())
+        with prefix_lock:
+            with self._context_lock:
+                if prefix in self.prefix_contexts:
+                    return self.prefix_contexts[prefix]
+            self.load()
+            context = prime_ollama_context(prefix, model=self.model, keep_alive=self.keep_alive, deadline=deadline)
+            with self._context_lock:
+                self.prefix_contexts[prefix] = context
+            return context
+
+    def generate_with_prefix(self, prompt, response_format=None, deadline=None):
+        """
+        Generates for a prompt laid out as static prefix + patient payload (see ai_instructions).
+        Records prefix reuse, and sends only the payload on top of the cached prefix context when reuse_context is on.
+        """
+        prefix, payload = split_ai_instruction(prompt)
+        if self.reuse_context and prefix:
+            context = self.prefix_context(prefix, deadline=deadline)
+            if context:
+                record_prefix("local", prefix, reused_tokens=len(context))
+                return self.generate(payload, response_format=response_format, deadline=deadline, context=context, raw=True)
+        record_prefix("local", prefix)
+        return self.generate(prompt, response_format=response_format, deadline=deadline)
+
+    def stream(self, prompt, deadline=None):
+        self.load()
+        yield from stream_ollama_model(prompt, model=self.model, keep_alive=self.keep_alive, deadline=deadline)
+
+    def reset_context(self):
+        with self._context_lock:
+            self.prefix_contexts = {}
+            self._prefix_locks = {}
+
+    def unload(self):
+        with self._lock:
+            reset_ai_model(self.model)
+            self.load_seconds = None
+        self.reset_context()
+
+    def __enter__(self):
+        self.load()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_local_session = None
+_local_session_lock = threading.Lock()
+
+def get_local_session():
+    """
+    Returns the per-process session shared by all section threads.
+    """
+    global _local_session
+    with _local_session_lock:
+        if _local_session is None or _local_session.model != local_summary_model:
+            _local_session = LocalModelSession(local_summary_model)
+        return _local_session
+
 # ----------------------------
 # Local LLM Response
 # ----------------------------
-def get_local_response(content):
+def get_local_response(content, use_cache=True, deadline=None, response_format=None):
     
     messages = [
         {
@@ -22,41 +204,75 @@ def get_local_response(content):
 
     # Combine all messages into a single prompt
     prompt = "\n".join([message["content"] for message in messages])
+
+    # Identical prompts to the same model are served from the persistent cache
+    cache_options = {"temperature": 0.9, "format": response_format}
+    cached = get_cached_response(local_summary_model, prompt, cache_options, use_cache=use_cache)
+    if cached is not None:
+        return cached
     
-    # Reset the model first
-    reset_ai_model(local_summary_model)
-    
-    # Query Ollama model with combined prompt
-    response = query_ollama_model(prompt, model=local_summary_model)  
+    # Query the resident Ollama model with combined prompt, within the machine-wide request limit
+    with llm_slot("local", deadline):
+        response = get_local_session().generate_with_prefix(prompt, response_format=response_format, deadline=deadline)
        
     if response:
+        store_response(local_summary_model, prompt, response, cache_options, use_cache=use_cache)
         return response
     else:
         return "Error!", "None"
 
+# ----------------------------
+# Local LLM Streaming Response
+# ----------------------------
+def stream_local_response(content, use_cache=True, deadline=None):
+    """
+    Yields the response text piece by piece as Ollama generates it.
+    A cached response is yielded in one piece. The full text is cached only if the
+    consumer reads the stream to the end (aborted generations are never stored).
+    """
+    prompt = content
+    cache_options = {"temperature": 0.9, "format": None}
+    cached = get_cached_response(local_summary_model, prompt, cache_options, use_cache=use_cache)
+    if cached is not None:
+        yield cached
+        return
+
+    pieces = []
+    # The request slot is held until the stream is exhausted or closed by the consumer
+    record_prefix("local", split_ai_instruction(prompt)[0])
+    with llm_slot("local", deadline):
+        for token in get_local_session().stream(prompt, deadline=deadline):
+            pieces.append(token)
+            yield token
+    store_response(local_summary_model, prompt, "".join(pieces), cache_options, use_cache=use_cache)
+
 # --------------------------------------------------
 # Function to call the Ollama-based Local Model
 # --------------------------------------------------
-def query_ollama_model(prompt: str, model: str = "llama3.2", response_format: dict = None) -> dict:
-    url = "http://127.0.0.1:11434/api/generate"  # Change to your Ollama endpoint if different
+def query_ollama_model(prompt: str, model: str = "llama3.2", response_format: dict = None, keep_alive=LOCAL_KEEP_ALIVE, deadline=None, context=None, raw=False) -> dict:
     payload = {
         "model": model,  # Name of your model (prometheus-local, llama3.2)
         "prompt": prompt,
         "stream": False,
         "format": response_format,
-        "temperature": 0.9        
-    }
-    headers = {
-        "Content-Type": "application/json"
+        "temperature": 0.9,
+        "keep_alive": keep_alive,
+        "options": {"num_ctx": OLLAMA_NUM_CTX}
     }
+    if raw:
+        payload["raw"] = True  # No chat template: the prompt continues the context token for token
+    if context:
+        payload["context"] = context  # Continue from an already evaluated prompt prefix
     # pdb.set_trace()
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
-    response.raise_for_status()  # Raise an error for bad responses
+    response = post_ollama(payload, deadline=deadline)  # Raises LLMRequestError on timeouts and bad statuses
 
     if response.status_code == 200:
         try:
             # Get the response content and use the passed schema for formatting
-            response_data = response.json()['response']  # Adjust based on actual response structure
+            response_json = response.json()
+            response_data = response_json['response']  # Adjust based on actual response structure
+            record_usage("local", response_json.get("prompt_eval_count"), response_json.get("eval_count"),
+                         response_json.get("total_duration", 0) / 1e9)
             
             if response_format:
                 # Optionally validate or format according to the response_format here
@@ -70,19 +286,72 @@ def query_ollama_model(prompt: str, model: str = "llama3.2", response_format: di
         print(f"Error: {response.status_code} - {response.text}")
         return None
 
-def reset_ai_model(model):
-    url = "http://127.0.0.1:11434/api/generate"  # Change to your Ollama endpoint if different
+# --------------------------------------------------
+# Evaluates a prompt prefix once and returns Ollama's context tokens for it
+# --------------------------------------------------
+def prime_ollama_context(prefix: str, model: str = "llama3.2", keep_alive=LOCAL_KEEP_ALIVE, deadline=None):
+    payload = {
+        "model": model,
+        "prompt": prefix,
+        "stream": False,
+        "raw": True,  # Untemplated, so the context holds exactly the prefix tokens
+        "keep_alive": keep_alive,
+        "options": {"num_predict": 0, "num_ctx": OLLAMA_NUM_CTX}  # Prefill only, no generated token
+    }
+    response = post_ollama(payload, deadline=deadline)
+    try:
+        return response.json().get("context")
+    except Exception as e:
+        print(f"Error parsing response: {e}")
+        return None
+
+# --------------------------------------------------
+# Streaming call to the Ollama-based Local Model (NDJSON, one object per line)
+# --------------------------------------------------
+def stream_ollama_model(prompt: str, model: str = "llama3.2", keep_alive=LOCAL_KEEP_ALIVE, deadline=None):
+    payload = {
+        "model": model,
+        "prompt": prompt,
+        "stream": True,
+        "temperature": 0.9,
+        "keep_alive": keep_alive,
+        "options": {"num_ctx": OLLAMA_NUM_CTX}
+    }
+    # With stream=True the read timeout applies between chunks, not to the whole generation
+    response = post_ollama(payload, deadline=deadline, stream=True)
+    try:
+        for line in response.iter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("error"):
+                raise LLMRequestError(HTTP, f"Ollama stream error: {chunk['error']}", "local")
+            if chunk.get("response"):
+                yield chunk["response"]
+            if chunk.get("done"):
+                record_usage("local", chunk.get("prompt_eval_count"), chunk.get("eval_count"),
+                             chunk.get("total_duration", 0) / 1e9)
+                break
+    except requests.exceptions.RequestException as e:
+        raise LLMRequestError(TIMEOUT, f"Ollama stream interrupted: {e}", "local") from e
+    finally:
+        # Closing the connection is what makes Ollama stop generating when the consumer aborts
+        response.close()
+
+# Loads the model without generating anything and pins it for keep_alive
+def load_ai_model(model, keep_alive=LOCAL_KEEP_ALIVE):
+    return reset_ai_model(model, keep_alive=keep_alive)
+
+# Unloads the model weights (keep_alive 0). Only use this at the end of a batch.
+def reset_ai_model(model, keep_alive=0):
     payload = {
         "model": model,  # Name of your model (prometheus-local, llama3.2)
         "prompt": "",
-        "keep_alive": 0        
-    }
-    headers = {
-        "Content-Type": "application/json"
+        "keep_alive": keep_alive,
+        "options": {"num_ctx": OLLAMA_NUM_CTX}  # Load with the context size later requests use
     }
     # pdb.set_trace()
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
-    response.raise_for_status()  # Raise an error for bad responses
+    response = post_ollama(payload, read_timeout=OLLAMA_LOAD_TIMEOUT)
 
     if response.status_code == 200:
         try:
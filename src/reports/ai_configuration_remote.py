@@ -1,15 +1,25 @@
 import os
 import pdb
-from groq import Groq
+from groq import Groq, APITimeoutError, APIConnectionError, APIStatusError
 import re
+from response_cache import get_cached_response, store_response
+from llm_limiter import llm_slot
+from llm_usage import record_usage, record_prefix
+from ai_instructions import split_ai_instruction
+from llm_errors import LLMRequestError, TIMEOUT, CONNECTION, HTTP, DEADLINE, remaining_time
 
 from dotenv import load_dotenv
 
 load_dotenv(dotenv_path="../.env")
 my_api_key = os.getenv("GROQ_API_KEY")
 
+# Request timeout in seconds. The Groq client keeps its own pooled keep-alive connections.
+REMOTE_TIMEOUT = float(os.getenv("NHORA_GROQ_TIMEOUT", "120"))
+
 client = Groq(
     api_key=my_api_key,
+    timeout=REMOTE_TIMEOUT,
+    max_retries=1,
 )
 # Setup local coding models to use
 remote_summarization_model = "llama-3.3-70b-versatile"
@@ -17,16 +27,20 @@ remote_summarization_model = "llama-3.3-70b-versatile"
 # ----------------------------
 # Remote LLM Response
 # ----------------------------
-def get_remote_response(content):    
-    chat_completion = client.chat.completions.create(
-        messages=[
-            {
-                "role": "user",
-                "content": content,
-            }
-        ],
-        model=remote_summarization_model
-    )
+def get_remote_response(content, use_cache=True, deadline=None, response_format=None):
+    # Identical prompts to the same model are served from the persistent cache
+    cache_options = {"format": response_format} if response_format else None
+    cached = get_cached_response(remote_summarization_model, content, cache_options, use_cache=use_cache)
+    if cached is not None:
+        return cached
+
+    record_prefix("remote", split_ai_instruction(content)[0])
+    with llm_slot("remote", deadline):
+        if response_format:
+            # Groq has no schema-constrained decoding; JSON mode plus validation by the caller
+            chat_completion = create_chat_completion(content, deadline=deadline, response_format={"type": "json_object"})
+        else:
+            chat_completion = create_chat_completion(content, deadline=deadline)
 
     response = chat_completion.choices[0].message.content
 
@@ -34,6 +48,9 @@ def get_remote_response(content):
     tokens_used = chat_completion.usage.total_tokens
     input_tokens = chat_completion.usage.prompt_tokens
     output_tokens = chat_completion.usage.completion_tokens
+    prompt_details = getattr(chat_completion.usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(prompt_details, "cached_tokens", 0) or 0  # Groq's prompt caching, when available
+    record_usage("remote", input_tokens, output_tokens, getattr(chat_completion.usage, "total_time", 0), cached_tokens)
     
     print(f"Total tokens used: {tokens_used}")
     print(f"Input tokens: {input_tokens}")
@@ -41,12 +58,75 @@ def get_remote_response(content):
 
     if response:      
         if "deepseek" in remote_summarization_model:       # For deepseek models, remove <think> tags
-            return remove_think_tags(response)
-        else:
-            return response    
+            response = remove_think_tags(response)
+        store_response(remote_summarization_model, content, response, cache_options, use_cache=use_cache)
+        return response
     else:
         return "Error!", "None"
     
+# ----------------------------
+# Remote LLM Streaming Response
+# ----------------------------
+def stream_remote_response(content, use_cache=True, deadline=None):
+    """
+    Yields the response text piece by piece from Groq's streaming chat completions.
+    A cached response is yielded in one piece; aborted generations are never cached.
+    """
+    cached = get_cached_response(remote_summarization_model, content, use_cache=use_cache)
+    if cached is not None:
+        yield cached
+        return
+
+    pieces = []
+    record_prefix("remote", split_ai_instruction(content)[0])
+    with llm_slot("remote", deadline):
+        stream = create_chat_completion(content, deadline=deadline, stream=True)
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if token:
+                    pieces.append(token)
+                    yield token
+        except (APITimeoutError, APIConnectionError) as e:
+            raise LLMRequestError(TIMEOUT, f"Groq stream interrupted: {e}", "remote") from e
+        finally:
+            stream.close()  # Stops the generation server-side when the consumer aborts
+
+    response = "".join(pieces)
+    if "deepseek" in remote_summarization_model:
+        response = remove_think_tags(response)
+    store_response(remote_summarization_model, content, response, use_cache=use_cache)
+
+def create_chat_completion(content, deadline=None, **kwargs):
+    """
+    Calls Groq with the timeout shortened to what is left of the deadline and maps
+    client failures to LLMRequestError.
+    """
+    remaining = remaining_time(deadline, "remote")
+    timeout, timeout_kind = REMOTE_TIMEOUT, TIMEOUT
+    if remaining is not None and remaining < timeout:
+        timeout, timeout_kind = remaining, DEADLINE
+    try:
+        return client.chat.completions.create(
+            messages=[
+                {
+                    "role": "user",
+                    "content": content,
+                }
+            ],
+            model=remote_summarization_model,
+            timeout=timeout,
+            **kwargs
+        )
+    except APITimeoutError as e:
+        raise LLMRequestError(timeout_kind, f"No response from Groq within {timeout:.0f}s", "remote") from e
+    except APIConnectionError as e:
+        raise LLMRequestError(CONNECTION, f"Could not reach Groq: {e}", "remote") from e
+    except APIStatusError as e:
+        raise LLMRequestError(HTTP, f"Groq returned {e.status_code}: {e.message}", "remote") from e
+
 def remove_think_tags(text):
     # Use regex to remove anything between <think> and </think>
     cleaned_text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
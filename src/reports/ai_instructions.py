@@ -1,32 +1,141 @@
 from example_sections import example_sections
 import pdb
 
-def get_ai_instruction(filled_values, section):
+# Separates the static part of every prompt (instructions + example) from the patient payload.
+# Everything before it is identical for all patients, so llama.cpp/Ollama and Groq can reuse its KV/prefix cache.
+PAYLOAD_MARKER = "Here are the various fields/lines I extracted from a .pdf:"
+
+def get_static_prefix(section):
     """
-    Generates an AI instruction message based on the provided filled values.
+    Returns the patient-independent start of the prompt for a section.
 
     Args:
-        filled_values (str): The filled values extracted from a PDF.
+        section (str): The report section.
 
     Returns:
-        str: The AI instruction message.
-    """    
+        str: Instructions followed by the section example.
+    """
     section_example = example_sections.get(section, "No example available for this section.")
     
     if section_example == "No example available for this section.":
         print(f"No example data available for {section}")
         pdb.set_trace()
 
-    # Define the AI instruction message
-    ai_message = f"Here are the various fields/lines I extracted from a .pdf: {filled_values}." + """
-    Please provide a comprehensive summary based on all the the information in the fields. 
+    return """
+    Please provide a comprehensive summary based on all the the information in the fields listed at the end of this message. 
     The very presence of a field indicates that it occurred. For e.g.
 
-    'Newborn Difficulties Jaundice': 'O' -> indicates that the patient had jaundice at birth.
-    'Developmental Concerns Feeding': 'O' -> indicates that the patient had feeding concerns at some point in their development.
+    'Newborn Difficulties Jaundice': 'On' -> indicates that the patient had jaundice at birth.
+    'Developmental Concerns Feeding': 'On' -> indicates that the patient had feeding concerns at some point in their development.
 
     Use the example below as a strict template. Your output **must** match its structure, length, and tone as closely as possible. 
     Do not add extra details or change the formatting:
-    ``` """ + f"{section_example}" + " ```"
+    ``` """ + f"{section_example}" + " ```\n"
+
+def get_ai_instruction(filled_values, section):
+    """
+    Generates an AI instruction message based on the provided filled values.
+    The static prefix comes first and the patient's fields last.
+
+    Args:
+        filled_values (str): The filled values extracted from a PDF.
+
+    Returns:
+        str: The AI instruction message.
+    """    
+    # Define the AI instruction message
+    ai_message = get_static_prefix(section) + f"{PAYLOAD_MARKER} {filled_values}."
+
+    return ai_message
+
+def split_ai_instruction(ai_message):
+    """
+    Splits an instruction into (static prefix, patient payload).
+    Messages that were not built with the marker are returned as ("", ai_message).
+    """
+    prefix, marker, payload = ai_message.rpartition(PAYLOAD_MARKER)
+    if not marker:
+        return "", ai_message
+    return prefix, marker + payload
+
+
+def get_combined_ai_instruction(extracted_data):
+    """
+    Generates a single AI instruction covering every section of one patient.
+    The shared instructions and every section's example come first; the patient's fields come last.
 
-    return ai_message
\ No newline at end of file
+    Args:
+        extracted_data (dict): {section: filled values} as returned by extract_sections.
+
+    Returns:
+        str: The AI instruction message. The model must answer with one JSON object keyed by section.
+    """
+    example_blocks = ""
+    field_blocks = ""
+    for section, filled_values in extracted_data.items():
+        section_example = example_sections.get(section, "No example available for this section.")
+        example_blocks += f"""
+    ### {section}
+    Example: ``` {section_example} ```
+    """
+        field_blocks += f"""
+    ### {section}
+    {filled_values}
+    """
+
+    # Static instructions and examples first, patient fields last (see PAYLOAD_MARKER)
+    ai_message = """
+    Below are several sections of a neuropsychological history form. For each section, please provide a
+    comprehensive summary based on all the information in that section's fields, which are listed at the end of this message.
+    The very presence of a field indicates that it occurred. For e.g.
+
+    'Newborn Difficulties Jaundice': 'On' -> indicates that the patient had jaundice at birth.
+    'Developmental Concerns Feeding': 'On' -> indicates that the patient had feeding concerns at some point in their development.
+
+    Use each section's example as a strict template. Each summary **must** match its example's structure, length, and tone as closely as possible.
+    Do not add extra details or change the formatting, and only use the fields given for that section.
+    """ + example_blocks + """
+    Respond with a single JSON object with exactly one key per section title above. Each value is that section's summary as a string.
+
+    """ + PAYLOAD_MARKER + field_blocks
+
+    return ai_message
+
+
+def get_combined_response_schema(sections):
+    """
+    JSON schema for the combined response (passed as Ollama's `format` parameter).
+    """
+    return {
+        "type": "object",
+        "properties": {section: {"type": "string"} for section in sections},
+        "required": list(sections),
+    }
+
+
+# ------------------------------------------------------------
+# Map-reduce prompts for inputs too long for one call (see long_inputs.py)
+# ------------------------------------------------------------
+def get_map_prefix(section):
+    """
+    Static start of the prompt that condenses one part of a long input.
+    """
+    return f"""
+    The fields/lines at the end of this message are one part of a longer source document.
+    It will be used to write the '{section}' section of a neuropsychological report.
+    Extract every fact relevant to that section (diagnoses, history, concerns, reasons for referral, dates).
+    Keep names, ages, dates and test results exactly as written. Ignore page headers, footers and boilerplate.
+    Answer with concise bullet points only. Do not write the section itself.
+    """
+
+def get_map_instruction(chunk, section, part, parts):
+    """
+    Map step: condenses one chunk of a long input. The static prefix comes first, the chunk last.
+    """
+    return get_map_prefix(section) + f"{PAYLOAD_MARKER} (part {part} of {parts}) {chunk}."
+
+def get_reduce_instruction(partial_summaries, section):
+    """
+    Reduce step: the regular section prompt, fed with the notes of every part in document order.
+    """
+    return get_ai_instruction({"notes from consecutive parts of the source document": partial_summaries}, section)
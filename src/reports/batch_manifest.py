@@ -0,0 +1,138 @@
+# ------------------------------------------------------------
+# Manifest of already generated reports, so a batch rerun only touches new or changed patients.
+# Each entry records what the report was built from: the input PDF content hash, the mapping
+# version (field_to_section_map.json), the prompt/example version, the model, the generation
+# mode (one call per section or one combined call) and the report template version (template + CSS).
+# If any of them changes, or the report file it produced is gone, the patient is processed again.
+# ------------------------------------------------------------
+import os
+import json
+import hashlib
+from datetime import datetime
+from example_sections import example_sections
+from ai_instructions import get_static_prefix, PAYLOAD_MARKER
+
+MANIFEST_NAME = ".nhora_manifest.json"
+MAPPING_PATH = '../mapping/field_to_section_map.json'
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")  # See report_renderer
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def folder_hash(folder_path, pattern="*.pdf"):
+    """
+    Combined hash of every matching file in a folder (names and contents).
+    """
+    digest = hashlib.sha256()
+    for path in sorted(folder_path.glob(pattern)):
+        digest.update(path.name.encode("utf-8"))
+        digest.update(file_hash(path).encode("ascii"))
+    return digest.hexdigest()
+
+
+def mapping_version(path=MAPPING_PATH):
+    return file_hash(path)
+
+
+def prompt_version():
+    """
+    Hash of everything that shapes the prompts: the instruction text and the section examples.
+    """
+    digest = hashlib.sha256(PAYLOAD_MARKER.encode("utf-8"))
+    for section in sorted(example_sections):
+        digest.update(section.encode("utf-8"))
+        digest.update(get_static_prefix(section).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def template_version(template_dir=TEMPLATE_DIR):
+    """
+    Hash of every file under templates/ (the report template and the CSS it inlines), names and contents.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(template_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, template_dir).encode("utf-8"))
+            digest.update(file_hash(path).encode("ascii"))
+    return digest.hexdigest()
+
+
+def make_fingerprint(input_hash, model, generation_mode, **extra):
+    fingerprint = {
+        "input_hash": input_hash,
+        "mapping_version": mapping_version(),
+        "prompt_version": prompt_version(),
+        "model": model,
+        "generation_mode": generation_mode,
+        "template_version": template_version(),
+    }
+    fingerprint.update(extra)
+    return fingerprint
+
+
+class BatchManifest:
+    """
+    JSON manifest stored next to the batch inputs: {key: fingerprint + output + completed_at}.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"⚠️ Ignoring unreadable manifest {self.path}: {e}")
+
+    def is_current(self, key, fingerprint):
+        entry = self.entries.get(str(key))
+        if not entry or not entry.get("output") or not os.path.exists(entry["output"]):
+            return False
+        return all(entry.get(name) == value for name, value in fingerprint.items())
+
+    def output_of(self, key):
+        return self.entries.get(str(key), {}).get("output")
+
+    def mark_done(self, key, fingerprint, output):
+        """
+        Records a patient as done, but only once its report file exists.
+
+        Returns:
+            bool: Whether the entry was recorded.
+        """
+        if not output or not os.path.exists(output):
+            print(f"⚠️ {key}: no report at {output}, left pending")
+            return False
+        self.entries[str(key)] = {**fingerprint, "output": str(output), "completed_at": datetime.now().isoformat(timespec="seconds")}
+        return True
+
+    def save(self):
+        # Write to a temporary file first so an interrupted run never leaves a corrupt manifest
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def split_pending(manifest, items, fingerprint_of, force=False):
+    """
+    Splits batch items into (pending, unchanged) and returns the fingerprints computed on the way.
+
+    Args:
+        items (list): Paths (PDFs or patient folders).
+        fingerprint_of (callable): item -> fingerprint dict.
+        force (bool): Treat every item as pending.
+    """
+    fingerprints = {item: fingerprint_of(item) for item in items}
+    pending = [item for item in items if force or not manifest.is_current(item, fingerprints[item])]
+    unchanged = [item for item in items if item not in pending]
+    return pending, unchanged, fingerprints
@@ -0,0 +1,53 @@
+# ------------------------------------------------------------
+# Compares the per-section mode (one LLM call per section) with the combined mode
+# (one structured call per patient) on total tokens and wall time.
+# The response cache is bypassed so both modes really hit the model.
+# Usage: python bench_combined_mode.py [local|remote] [patient_dir] [max_patients]
+# ------------------------------------------------------------
+import sys
+import time
+from functools import partial
+from pathlib import Path
+from extract_neuropsych_form import extract_pdf_form_data, extract_sections, load_field_to_section_map
+from ai_configuration_local import get_local_response
+from ai_configuration_remote import get_remote_response
+from section_runner import generate_sections, generate_sections_combined
+from llm_usage import get_usage, reset_usage, format_usage
+from main_multiprocess import ROOT_DIR, TARGET_SECTIONS
+
+
+def run_mode(label, runner, get_response, patients, backend):
+    reset_usage()
+    start = time.time()
+    failed_sections = 0
+    for extracted_data in patients:
+        _section_data, errors = runner(extracted_data, get_response)
+        failed_sections += len(errors)
+    elapsed = time.time() - start
+    usage = get_usage(backend)
+    print(f"{label:<9} {elapsed:8.2f}s wall  {format_usage(usage)}  failed sections: {failed_sections}")
+    return elapsed, usage
+
+
+if __name__ == "__main__":
+    backend = sys.argv[1] if len(sys.argv) > 1 else "local"
+    root_dir = Path(sys.argv[2]) if len(sys.argv) > 2 else ROOT_DIR
+    max_patients = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    get_response = partial(get_local_response if backend == "local" else get_remote_response, use_cache=False)
+    field_section_map = load_field_to_section_map()
+    patients = [
+        extract_sections(extract_pdf_form_data(fpath), TARGET_SECTIONS, field_section_map)
+        for fpath in sorted(root_dir.rglob('*.pdf'))[:max_patients]
+    ]
+    print(f"Benchmarking {len(patients)} patients on the {backend} backend\n")
+
+    sections_time, sections_usage = run_mode("sections", generate_sections, get_response, patients, backend)
+    combined_time, combined_usage = run_mode("combined", generate_sections_combined, get_response, patients, backend)
+
+    def total_tokens(usage):
+        return usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+
+    print(f"\nWall time: {sections_time / max(combined_time, 1e-9):.2f}x faster in combined mode")
+    print(f"Tokens:    {total_tokens(sections_usage)} -> {total_tokens(combined_usage)} "
+          f"({total_tokens(combined_usage) - total_tokens(sections_usage):+d})")
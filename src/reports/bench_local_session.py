@@ -0,0 +1,68 @@
+# ------------------------------------------------------------
+# Before/after timing for the local model session.
+# "reset" mode reproduces the old behaviour (unload the model before every section),
+# "session" mode keeps the model resident for the whole batch.
+# Usage: python bench_local_session.py [patient_dir] [max_patients]
+# ------------------------------------------------------------
+import sys
+import time
+from pathlib import Path
+from extract_neuropsych_form import extract_pdf_form_data, extract_sections, load_field_to_section_map
+from ai_configuration_local import LocalModelSession, local_summary_model, query_ollama_model, reset_ai_model
+from ai_instructions import get_ai_instruction
+from main_multiprocess import ROOT_DIR, TARGET_SECTIONS
+
+
+def load_prompts(root_dir, max_patients):
+    field_section_map = load_field_to_section_map()
+    prompts = []
+    for fpath in sorted(Path(root_dir).rglob('*.pdf'))[:max_patients]:
+        extracted_data = extract_sections(extract_pdf_form_data(fpath), TARGET_SECTIONS, field_section_map)
+        prompts.extend(get_ai_instruction(data, section) for section, data in extracted_data.items())
+    return prompts
+
+
+def run_reset_mode(prompts):
+    timings = []
+    for prompt in prompts:
+        start = time.time()
+        reset_ai_model(local_summary_model)
+        query_ollama_model(prompt, model=local_summary_model)
+        timings.append(time.time() - start)
+    return timings
+
+
+def run_session_mode(prompts):
+    timings = []
+    session = LocalModelSession(local_summary_model)
+    session.load()
+    for prompt in prompts:
+        start = time.time()
+        session.generate(prompt)
+        timings.append(time.time() - start)
+    return timings, session.load_seconds
+
+
+def summarize(label, timings, extra=0.0):
+    total = sum(timings) + extra
+    print(f"{label:<10} calls={len(timings):<4} total={total:8.2f}s  "
+          f"mean/section={sum(timings) / max(len(timings), 1):6.2f}s  "
+          f"max/section={max(timings, default=0):6.2f}s")
+    return total
+
+
+if __name__ == "__main__":
+    root_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else ROOT_DIR
+    max_patients = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    prompts = load_prompts(root_dir, max_patients)
+    print(f"Benchmarking {len(prompts)} section prompts from {root_dir} on {local_summary_model}\n")
+
+    reset_ai_model(local_summary_model)  # Both modes start from a cold model
+    before = summarize("reset", run_reset_mode(prompts))
+
+    reset_ai_model(local_summary_model)
+    timings, load_seconds = run_session_mode(prompts)
+    after = summarize("session", timings, extra=load_seconds)
+    print(f"{'':<10} (includes one-time load of {load_seconds:.2f}s)")
+
+    print(f"\nSpeed-up: {before / after:.2f}x ({before - after:.2f}s saved)")
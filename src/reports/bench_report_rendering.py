@@ -0,0 +1,83 @@
+# ------------------------------------------------------------
+# Micro-benchmark of report rendering on synthetic patients.
+# Compares compiling the report template for every patient (what the f-string + Template
+# version did) with the cached template, rendered to a string and streamed to a file.
+# Usage: python bench_report_rendering.py [reports]
+# ------------------------------------------------------------
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+from example_sections import example_sections
+from report_renderer import get_environment, get_report_template, report_sections, stream_summary_html, REPORT_TEMPLATE
+
+TARGET_SECTIONS = [
+    'Background Info Header',
+    'Concerns Prompting This Evaluation',
+    'Medical History',
+    'Birth & Development History',
+    'School History',
+    'Family History'
+]
+
+
+def synthetic_patient(i):
+    section_data = {section: f"{text.strip()}\n\n(Patient {i})" for section, text in example_sections.items()}
+    patient_info = {
+        "name": f"Patient {i}",
+        "medical_record_no": f"{100000 + i}",
+        "date_of_birth": "01/01/2012",
+        "dates_of_service": "03/04/2025",
+        "age_at_evaluation": "13 years",
+        "examiners": ["Stephanie K. Powell, Ph.D.", "Monica O. Thomas, M.A."],
+    }
+    return section_data, patient_info
+
+
+def compile_per_report(section_data, patient_info):
+    source = get_environment().loader.get_source(get_environment(), REPORT_TEMPLATE)[0]
+    template = get_environment().from_string(source)
+    return template.render(sections=report_sections(section_data, TARGET_SECTIONS), patient_info=patient_info)
+
+
+def cached_render(section_data, patient_info):
+    return "".join(stream_summary_html(section_data, patient_info, TARGET_SECTIONS))
+
+
+def make_streamed(output_dir):
+    def streamed(section_data, patient_info):
+        with open(os.path.join(output_dir, "report.html"), "w", encoding="utf-8") as f:
+            for chunk in stream_summary_html(section_data, patient_info, TARGET_SECTIONS):
+                f.write(chunk)
+        return ""
+    return streamed
+
+
+def run(label, render, patients):
+    tracemalloc.start()
+    start = time.perf_counter()
+    total_chars = 0
+    for section_data, patient_info in patients:
+        total_chars += len(render(section_data, patient_info))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label:<22} {len(patients) / elapsed:8.1f} reports/s  {elapsed * 1000 / len(patients):7.3f} ms/report  "
+          f"peak {peak / (1024 * 1024):6.2f} MB")
+    return elapsed
+
+
+if __name__ == "__main__":
+    reports = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    patients = [synthetic_patient(i) for i in range(reports)]
+    get_report_template()  # Compile once up front, as every worker process does on its first report
+    print(f"Rendering {reports} synthetic reports\n")
+
+    baseline = run("compile per report", compile_per_report, patients)
+    cached = run("cached template", cached_render, patients)
+    with tempfile.TemporaryDirectory() as output_dir:
+        streamed = run("cached, streamed", make_streamed(output_dir), patients)
+
+    print(f"\nSpeed-up: {baseline / cached:.2f}x (render), {baseline / streamed:.2f}x (streamed to file)")
@@ -0,0 +1,131 @@
+# ------------------------------------------------------------
+# Small persistent key/value cache on top of sqlite3.
+# Used to avoid repeating expensive work (LLM calls, OCR) across runs.
+# Safe to share between the processes of a multiprocessing pool: every
+# operation opens its own short-lived connection to the same file.
+# ------------------------------------------------------------
+import os
+import time
+import sqlite3
+import hashlib
+import json
+from contextlib import closing
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # 512 MB
+
+
+def make_cache_key(*parts):
+    """
+    Builds a stable content-addressed key from any JSON-serializable parts.
+    """
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    Size-bounded LRU cache stored in a single sqlite file.
+
+    Args:
+        path (str): Location of the sqlite file (created if missing).
+        max_bytes (int): Total size of stored values before least recently used entries are evicted.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self._initialized = False
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON entries(last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self._initialized = True
+        return conn
+
+    def _bump(self, conn, name):
+        conn.execute(
+            "INSERT INTO counters(name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None on a miss.
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._bump(conn, "misses")
+                return None
+            conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._bump(conn, "hits")
+            return row[0]
+
+    def set(self, key, value):
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return  # Never store something that would evict the whole cache
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries(key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        conn.execute(
+            "INSERT INTO counters(name, value) VALUES ('evictions', ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + ?",
+            (evicted, evicted),
+        )
+
+    def stats(self):
+        """
+        Returns entry count, stored bytes and hit/miss/eviction counters.
+        Counters are shared by every process using the same cache file.
+        """
+        with closing(self._connect()) as conn:
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        lookups = hits + misses
+        return {
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "evictions": counters.get("evictions", 0),
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+    def reset_stats(self):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM counters")
+
+    def clear(self):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM counters")
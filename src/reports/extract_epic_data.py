@@ -1,7 +1,54 @@
+import os
 import re
 import pdb
+import time
+import atexit
+import threading
+import subprocess
+import multiprocessing
+from collections import deque
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import pytesseract
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
+from ocr_cache import get_cached_page, store_page
+from batch_manifest import file_hash
+from pdf_source import materialized_pdf
+
+# OCR settings (override with environment variables)
+OCR_DPI = int(os.getenv("NHORA_OCR_DPI", "200"))                          # pdf2image's default resolution
+OCR_GRAYSCALE = os.getenv("NHORA_OCR_GRAYSCALE", "1") == "1"               # 1/3 of the memory of RGB, same OCR quality
+OCR_WORKERS = int(os.getenv("NHORA_OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_MAX_IN_FLIGHT = int(os.getenv("NHORA_OCR_MAX_IN_FLIGHT", str(OCR_WORKERS)))  # Caps page images held in memory
+TESSERACT_CONFIG = os.getenv("NHORA_TESSERACT_CONFIG", "")
+MIN_TEXT_LAYER_CHARS = int(os.getenv("NHORA_MIN_TEXT_LAYER_CHARS", "200"))  # Fewer non-blank characters: treat the page as scanned
+SCANNED_PAGE_COVERAGE = float(os.getenv("NHORA_SCANNED_PAGE_COVERAGE", "0.5"))  # Pages this much covered by images are OCR'd
+TEXT_LAYER_TIMEOUT = 60
+
+# Region-of-interest mode: a cheap low-resolution pass finds the section headers, then only
+# the regions of the wanted sections are OCR'd at OCR_DPI
+ROI_SCAN_DPI = int(os.getenv("NHORA_ROI_SCAN_DPI", "72"))
+EPIC_SECTION_HEADERS = [
+    "Reason for Referral",
+    "History of Present Illness",
+    "Past Medical History",
+    "Past Surgical History",
+    "Family History",
+    "Social History",
+    "Medications",
+    "Allergies",
+    "Review of Systems",
+    "Assessment",
+    "Plan",
+]
+
+# How each page was read, for the batch summary
+PAGE_SOURCES = ("text", "cache", "ocr")
+_page_sources = {source: {"pages": 0, "seconds": 0.0} for source in PAGE_SOURCES}
+_documents_read = 0
+_page_sources_lock = threading.Lock()
+
+SECTION_HEADER_RE = re.compile(r"^=+\s*(.*?)\s*=+$")
 
 def parse_epic_sections(text):
     """
@@ -13,7 +60,7 @@ def parse_epic_sections(text):
     buffer = []
 
     # Regex for headers like "=== Section Name ==="
-    section_header_re = re.compile(r"^=+\s*(.*?)\s*=+$")
+    section_header_re = SECTION_HEADER_RE
 
     for line in text.splitlines():
         header_match = section_header_re.match(line)
@@ -34,18 +81,225 @@ def parse_epic_sections(text):
 
     return sections
 
-def extract_text_from_pdf(pdf_path):
+def count_pdf_pages(pdf_path):
+    return pdfinfo_from_path(str(pdf_path))["Pages"]
+
+def ocr_page(pdf_path, page_number, dpi=OCR_DPI, grayscale=OCR_GRAYSCALE, tesseract_config=TESSERACT_CONFIG):
+    """
+    Rasterizes a single page (1-based) and OCRs it. Only this page's image is ever in memory.
+    """
+    images = convert_from_path(str(pdf_path), dpi=dpi, first_page=page_number, last_page=page_number, grayscale=grayscale)
+    try:
+        return pytesseract.image_to_string(images[0], config=tesseract_config) if images else ""
+    finally:
+        for img in images:
+            img.close()
+
+_ocr_executor = None
+
+def set_ocr_workers(workers, max_in_flight=None):
+    """
+    Overrides the page-level parallelism of this process, e.g. to 1 in processes that already
+    parallelize across documents.
+    """
+    global OCR_WORKERS, OCR_MAX_IN_FLIGHT
+    OCR_WORKERS = workers
+    OCR_MAX_IN_FLIGHT = max_in_flight or workers
+
+def get_ocr_executor(workers):
+    """
+    Process pool shared by every document OCR'd in this process.
+    """
+    global _ocr_executor
+    if _ocr_executor is None:
+        _ocr_executor = ProcessPoolExecutor(max_workers=workers)
+        atexit.register(_ocr_executor.shutdown, wait=False, cancel_futures=True)
+    return _ocr_executor
+
+def extract_text_layer(pdf_path):
+    """
+    Embedded text of every page, via poppler's pdftotext (installed alongside pdf2image).
+    Pages are separated by form feeds in pdftotext's output.
+
+    Returns:
+        list: Text per page, or [] when the text layer cannot be read.
+    """
+    try:
+        result = subprocess.run(
+            ["pdftotext", "-enc", "UTF-8", str(pdf_path), "-"],
+            capture_output=True, timeout=TEXT_LAYER_TIMEOUT, check=True,
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"⚠️ No text layer for {Path(pdf_path).name}, using OCR: {e}")
+        return []
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    return pages[:-1] if pages and not pages[-1].strip() else pages
+
+def page_image_coverage(pdf_path):
+    """
+    Share of each page's area covered by embedded images, via poppler's pdfimages -list.
+    A scan is one page-sized image, whatever text (banner, stamp, footer) was printed over it.
+
+    Returns:
+        dict: {page_index: coverage between 0 and 1} (pages without images are missing),
+            or None when the image list cannot be read.
+    """
+    try:
+        page_size = re.findall(r"[\d.]+", pdfinfo_from_path(str(pdf_path))["Page size"])
+        page_area = float(page_size[0]) * float(page_size[1])  # Points
+        result = subprocess.run(
+            ["pdfimages", "-list", str(pdf_path)],
+            capture_output=True, timeout=TEXT_LAYER_TIMEOUT, check=True,
+        )
+    except (OSError, subprocess.SubprocessError, KeyError, IndexError, ValueError) as e:
+        print(f"⚠️ No image list for {Path(pdf_path).name}, relying on text length only: {e}")
+        return None
+
+    coverage = {}
+    # Columns: page num type width height color comp bpc enc interp object ID x-ppi y-ppi size ratio
+    for line in result.stdout.decode("utf-8", errors="replace").splitlines()[2:]:
+        fields = line.split()
+        if len(fields) < 14 or fields[2] != "image":
+            continue  # Masks and stencils are not page content
+        try:
+            width, height, x_ppi, y_ppi = (float(fields[i]) for i in (3, 4, 12, 13))
+            area = (width / x_ppi * 72) * (height / y_ppi * 72)
+        except (ValueError, ZeroDivisionError):
+            continue
+        page_index = int(fields[0]) - 1
+        coverage[page_index] = min(1.0, coverage.get(page_index, 0.0) + area / page_area)
+    return coverage
+
+def has_text_layer(page_text, coverage=None, min_chars=MIN_TEXT_LAYER_CHARS, max_coverage=SCANNED_PAGE_COVERAGE):
+    """
+    Whether a page's embedded text can stand in for OCR. Scanned pages usually carry no text, or only
+    a header/footer/stamp layer: they are OCR'd when mostly covered by an image or when the text is short.
+    """
+    if coverage is not None and coverage >= max_coverage:
+        return False
+    return len("".join(page_text.split())) >= min_chars
+
+def iter_page_texts(pdf_path, dpi=OCR_DPI, grayscale=OCR_GRAYSCALE, workers=None, max_in_flight=None, tesseract_config=TESSERACT_CONFIG, use_cache=True, use_text_layer=True):
+    """
+    Yields (page_index, text, source) in page order, where source is "text" (embedded text layer),
+    "cache" (OCR cache hit) or "ocr". Image-only pages are rasterized and OCR'd in parallel, with
+    at most max_in_flight pages being processed (and held as images) at any time.
+    """
+    workers = OCR_WORKERS if workers is None else workers
+    max_in_flight = OCR_MAX_IN_FLIGHT if max_in_flight is None else max_in_flight
+    page_count = count_pdf_pages(pdf_path)
+    text_layer = extract_text_layer(pdf_path) if use_text_layer else []
+    image_coverage = (page_image_coverage(pdf_path) if text_layer else None) or {}
+    doc_hash = file_hash(pdf_path)
+
+    def resolve(page_index):
+        # Text already available without OCR: (text, source), or (None, None)
+        if page_index < len(text_layer) and has_text_layer(text_layer[page_index], image_coverage.get(page_index, 0.0)):
+            return text_layer[page_index], "text"
+        text = get_cached_page(doc_hash, page_index, dpi, grayscale, tesseract_config, use_cache)
+        return (text, "cache") if text is not None else (None, None)
+
+    def store(page_index, text):
+        store_page(doc_hash, page_index, dpi, grayscale, tesseract_config, text, use_cache)
+
+    # Pool workers are daemonic and cannot start their own processes: OCR page by page instead
+    if workers <= 1 or multiprocessing.current_process().daemon:
+        for page_index in range(page_count):
+            text, source = resolve(page_index)
+            if text is None:
+                text, source = ocr_page(pdf_path, page_index + 1, dpi, grayscale, tesseract_config), "ocr"
+                store(page_index, text)
+            yield page_index, text, source
+        return
+
+    executor = get_ocr_executor(workers)
+    in_flight = deque()  # (page_index, future or None, resolved text, source)
+    next_index = 0
+    while next_index < page_count or in_flight:
+        while next_index < page_count and len(in_flight) < max_in_flight:
+            text, source = resolve(next_index)
+            future = None if text is not None else executor.submit(ocr_page, str(pdf_path), next_index + 1, dpi, grayscale, tesseract_config)
+            in_flight.append((next_index, future, text, source))
+            next_index += 1
+        page_index, future, text, source = in_flight.popleft()
+        if future is not None:
+            text, source = future.result(), "ocr"
+            store(page_index, text)
+        yield page_index, text, source
+
+def record_page_sources(pdf_path, page_report):
+    global _documents_read
+    with _page_sources_lock:
+        for _, source, seconds in page_report:
+            _page_sources[source]["pages"] += 1
+            _page_sources[source]["seconds"] += seconds
+        _documents_read += 1
+
+    counts = {source: sum(1 for _, s, _ in page_report if s == source) for source in PAGE_SOURCES}
+    print(f"📄 {Path(pdf_path).name}: " + ", ".join(f"{counts[s]} {s}" for s in PAGE_SOURCES) + f" ({len(page_report)} pages)")
+
+def get_page_source_stats():
+    with _page_sources_lock:
+        stats = {source: dict(counters) for source, counters in _page_sources.items()}
+        stats["documents"] = _documents_read
+        return stats
+
+def take_page_source_stats():
+    """
+    Returns this process's page counters and resets them, so a worker process can send what it
+    read back with its result (see merge_page_source_stats).
+    """
+    global _documents_read
+    with _page_sources_lock:
+        stats = {source: dict(counters) for source, counters in _page_sources.items()}
+        stats["documents"] = _documents_read
+        for counters in _page_sources.values():
+            counters.update(pages=0, seconds=0.0)
+        _documents_read = 0
+        return stats
+
+def merge_page_source_stats(stats):
+    global _documents_read
+    with _page_sources_lock:
+        for source in PAGE_SOURCES:
+            _page_sources[source]["pages"] += stats[source]["pages"]
+            _page_sources[source]["seconds"] += stats[source]["seconds"]
+        _documents_read += stats["documents"]
+
+def print_page_source_stats():
+    """
+    Batch summary of how Epic pages were read: by this process, plus whatever workers handed back.
     """
-    OCR-based text extraction from image-based PDFs.
+    stats = get_page_source_stats()
+    pages = sum(stats[source]["pages"] for source in PAGE_SOURCES)
+    if not pages:
+        return
+    parts = []
+    for source in PAGE_SOURCES:
+        counters = stats[source]
+        parts.append(f"{source}: {counters['pages']} ({counters['pages'] / pages:.0%}, {counters['seconds']:.1f}s)")
+    print(f"📄 Epic pages ({stats['documents']} documents, {pages} pages) - " + ", ".join(parts))
+
+def extract_text_from_pdf(pdf_path, dpi=OCR_DPI, grayscale=OCR_GRAYSCALE, workers=None, max_in_flight=None, use_cache=True, use_text_layer=True):
     """
+    Text extraction from Epic PDFs (path or bytes). Pages with an embedded text layer are read directly;
+    image-only pages are rasterized one at a time, spread across a process pool and cached per page.
+    """
+    # poppler needs a file: uploads get a scratch copy that is removed when extraction ends
+    with materialized_pdf(pdf_path) as path:
+        return _extract_text_from_pdf(path, dpi, grayscale, workers, max_in_flight, use_cache, use_text_layer)
+
+def _extract_text_from_pdf(pdf_path, dpi, grayscale, workers, max_in_flight, use_cache, use_text_layer):
     try:
-        # Convert PDF to images
-        images = convert_from_path(str(pdf_path))
         full_text = ""
+        page_report = []  # (page_index, source, seconds until the page was available)
+        start = time.time()
 
-        for img in images:
-            text = pytesseract.image_to_string(img)
+        for page_index, text, source in iter_page_texts(pdf_path, dpi, grayscale, workers, max_in_flight, use_cache=use_cache, use_text_layer=use_text_layer):
             full_text += text + "\n"
+            page_report.append((page_index, source, time.time() - start))
+            start = time.time()
+        record_page_sources(pdf_path, page_report)
         
         # Split the extracted full_text by new lines and remove empty lines
         lines = [line.strip() for line in full_text.strip().split("\n") if line.strip()]
@@ -58,5 +312,132 @@ def extract_text_from_pdf(pdf_path):
         
         # return full_text.strip()
     except Exception as e:
-        print(f"❌ OCR failed on {pdf_path.name}: {e}")
-        return ""
\ No newline at end of file
+        print(f"❌ OCR failed on {Path(pdf_path).name}: {e}")
+        return ""
+
+def match_section_header(line_text, known_headers=EPIC_SECTION_HEADERS):
+    """
+    Returns the section name if an OCR'd line is a section header, else None.
+    Recognizes "=== Section ===" headers and lines starting with a known Epic heading.
+    """
+    line_text = line_text.strip()
+    header_match = SECTION_HEADER_RE.match(line_text)
+    if header_match:
+        return header_match.group(1).strip()
+    lowered = line_text.lower().rstrip(":")
+    for header in known_headers:
+        if lowered == header.lower() or lowered.startswith(header.lower() + ":"):
+            return header
+    return None
+
+def locate_section_headers(image, known_headers=EPIC_SECTION_HEADERS):
+    """
+    Finds section headers on a (low-resolution) page image.
+
+    Returns:
+        list: [(section, top, bottom)] in image pixels, top to bottom.
+    """
+    data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+    lines = {}
+    for i, word in enumerate(data["text"]):
+        if not word.strip():
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        top, height = data["top"][i], data["height"][i]
+        words, line_top, line_bottom = lines.get(key, ([], top, top + height))
+        words.append(word)
+        lines[key] = (words, min(line_top, top), max(line_bottom, top + height))
+
+    headers = []
+    for words, top, bottom in lines.values():
+        section = match_section_header(" ".join(words), known_headers)
+        if section:
+            headers.append((section, top, bottom))
+    return sorted(headers, key=lambda header: header[1])
+
+def plan_section_regions(page_headers, page_heights, wanted):
+    """
+    Turns the headers found on each page into vertical regions per wanted section.
+    A section runs from below its header to the next header, continuing across page breaks.
+
+    Args:
+        page_headers (list): locate_section_headers() result per page.
+        page_heights (list): Low-resolution page height per page.
+        wanted (set): Sections to keep.
+
+    Returns:
+        dict: {page_index: [(section, top, bottom)]} in low-resolution pixels.
+    """
+    regions = {}
+    current = None
+    for page_index, (headers, height) in enumerate(zip(page_headers, page_heights)):
+        start = 0
+        for section, top, bottom in headers:
+            if current in wanted and top > start:
+                regions.setdefault(page_index, []).append((current, start, top))
+            current, start = section, bottom
+        if current in wanted and height > start:
+            regions.setdefault(page_index, []).append((current, start, height))
+    return regions
+
+def ocr_page_regions(pdf_path, page_number, regions, dpi=OCR_DPI, scan_dpi=ROI_SCAN_DPI, grayscale=OCR_GRAYSCALE, tesseract_config=TESSERACT_CONFIG):
+    """
+    Rasterizes one page at full resolution and OCRs only the given regions.
+
+    Returns:
+        list: [(section, text)] in region order.
+    """
+    scale = dpi / scan_dpi
+    images = convert_from_path(str(pdf_path), dpi=dpi, first_page=page_number, last_page=page_number, grayscale=grayscale)
+    try:
+        if not images:
+            return []
+        page = images[0]
+        results = []
+        for section, top, bottom in regions:
+            box = (0, max(0, int(top * scale)), page.width, min(page.height, int(bottom * scale) + 1))
+            with page.crop(box) as crop:
+                results.append((section, pytesseract.image_to_string(crop, config=tesseract_config)))
+        return results
+    finally:
+        for img in images:
+            img.close()
+
+def extract_epic_regions(pdf_path, sections=("Reason for Referral",), known_headers=EPIC_SECTION_HEADERS, dpi=OCR_DPI, scan_dpi=ROI_SCAN_DPI, grayscale=OCR_GRAYSCALE):
+    """
+    Layout-aware extraction: a low-resolution pass locates section headers, then only the regions
+    of the wanted sections are OCR'd at full resolution. Pages without wanted content are never
+    rasterized at full resolution. Accepts a path or bytes.
+
+    Returns:
+        dict: {section: {"text": [lines]}} for the wanted sections that were found
+            (same shape as the epic_report handler's to_sections).
+    """
+    with materialized_pdf(pdf_path) as path:
+        return _extract_epic_regions(path, sections, known_headers, dpi, scan_dpi, grayscale)
+
+def _extract_epic_regions(pdf_path, sections, known_headers, dpi, scan_dpi, grayscale):
+    wanted = set(sections)
+    known_headers = list(dict.fromkeys(list(known_headers) + list(sections)))
+    try:
+        page_headers, page_heights = [], []
+        for page_number in range(1, count_pdf_pages(pdf_path) + 1):
+            images = convert_from_path(str(pdf_path), dpi=scan_dpi, first_page=page_number, last_page=page_number, grayscale=True)
+            try:
+                page_headers.append(locate_section_headers(images[0], known_headers) if images else [])
+                page_heights.append(images[0].height if images else 0)
+            finally:
+                for img in images:
+                    img.close()
+
+        regions = plan_section_regions(page_headers, page_heights, wanted)
+        texts = {}
+        for page_index in sorted(regions):
+            for section, text in ocr_page_regions(pdf_path, page_index + 1, regions[page_index], dpi, scan_dpi, grayscale):
+                texts.setdefault(section, []).extend(line.strip() for line in text.split("\n") if line.strip())
+
+        print(f"🔎 {Path(pdf_path).name}: {len(regions)}/{len(page_headers)} pages OCR'd at {dpi} dpi for {sorted(texts) or 'no sections'}")
+        return {section: {"text": texts[section]} for section in sections if section in texts}
+    except Exception as e:
+        print(f"❌ Region OCR failed on {Path(pdf_path).name}: {e}")
+        return {}
@@ -4,6 +4,11 @@
 import pandas as pd
 import json
 import re
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mapping'))
+from compiled_mapping import build_compiled_mapping
 
 def clean_value(val):
     if pd.isna(val):
@@ -66,3 +71,7 @@ if __name__ == "__main__":
         json.dump(data, f, indent=2)
 
     print(f"JSON saved to {output_file}")
+
+    # Precompute the field -> sections index used by extract_sections and map_patient_data_to_template
+    build_compiled_mapping(output_file)
+    print(f"Compiled mapping saved next to {output_file}")
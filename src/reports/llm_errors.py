@@ -0,0 +1,54 @@
+# ------------------------------------------------------------
+# Structured errors for LLM calls, shared by the local and remote backends.
+# Callers get a `kind` they can report per section instead of a bare traceback or a stalled worker.
+# ------------------------------------------------------------
+import time
+
+# Kinds of failure reported back to the batch runners
+TIMEOUT = "timeout"          # The server did not answer within the read timeout
+CONNECTION = "connection"    # The server could not be reached
+HTTP = "http"                # The server answered with an error status
+DEADLINE = "deadline"        # The per-patient deadline expired before the call finished
+
+
+class LLMRequestError(Exception):
+    def __init__(self, kind, message, backend=None):
+        super().__init__(message)
+        self.kind = kind
+        self.message = message
+        self.backend = backend
+
+    def to_dict(self):
+        return {"kind": self.kind, "backend": self.backend, "message": self.message}
+
+    def __str__(self):
+        return f"[{self.backend or 'llm'} {self.kind}] {self.message}"
+
+
+def make_deadline(seconds):
+    """
+    Returns an absolute deadline (time.monotonic based) or None when seconds is None.
+    """
+    return None if seconds is None else time.monotonic() + seconds
+
+
+def remaining_time(deadline, backend=None):
+    """
+    Returns the seconds left before the deadline (None if there is no deadline).
+    Raises LLMRequestError once the deadline has passed.
+    """
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise LLMRequestError(DEADLINE, "Patient deadline expired before the request was sent", backend)
+    return remaining
+
+
+def describe_error(error):
+    """
+    Converts any exception raised by a section call into a structured record.
+    """
+    if isinstance(error, LLMRequestError):
+        return error.to_dict()
+    return {"kind": type(error).__name__, "backend": None, "message": str(error)}
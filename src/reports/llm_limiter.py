@@ -0,0 +1,62 @@
+# ------------------------------------------------------------
+# Caps the number of in-flight LLM requests across every worker process of a batch.
+# The semaphores are created once in the parent and handed to each pool worker through
+# the Pool initializer, so extraction and rendering still use every core while the
+# model server only ever sees as many requests as it can actually serve.
+# ------------------------------------------------------------
+import os
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from llm_errors import LLMRequestError, DEADLINE, remaining_time
+
+# Maximum simultaneous requests per backend (override with environment variables)
+LLM_CONCURRENCY = {
+    "local": int(os.getenv("NHORA_MAX_LOCAL_REQUESTS", "2")),    # Ollama serves only a few requests in parallel
+    "remote": int(os.getenv("NHORA_MAX_REMOTE_REQUESTS", "8")),  # Groq is bounded by rate limits instead
+}
+
+_semaphores = {}
+_semaphores_lock = threading.Lock()
+
+
+def create_llm_semaphores(limits=None):
+    """
+    Creates the shared semaphores. Call this in the parent process before starting the pool.
+
+    Args:
+        limits (dict): Optional {backend: max_in_flight} overriding LLM_CONCURRENCY.
+    """
+    limits = {**LLM_CONCURRENCY, **(limits or {})}
+    return {backend: multiprocessing.BoundedSemaphore(limit) for backend, limit in limits.items()}
+
+
+def init_llm_limiter(semaphores):
+    """
+    Pool initializer: installs the parent's semaphores in this worker process.
+    """
+    global _semaphores
+    _semaphores = dict(semaphores)
+
+
+def _get_semaphore(backend):
+    with _semaphores_lock:
+        if backend not in _semaphores:
+            # Not started from a batch runner - fall back to a per-process limit
+            _semaphores[backend] = threading.BoundedSemaphore(LLM_CONCURRENCY.get(backend, 1))
+        return _semaphores[backend]
+
+
+@contextmanager
+def llm_slot(backend, deadline=None):
+    """
+    Blocks until a request slot for this backend is free and holds it for the duration of the block.
+    Gives up with a structured deadline error if no slot frees up before the deadline.
+    """
+    semaphore = _get_semaphore(backend)
+    if not semaphore.acquire(timeout=remaining_time(deadline, backend)):
+        raise LLMRequestError(DEADLINE, "Patient deadline expired while waiting for a request slot", backend)
+    try:
+        yield
+    finally:
+        semaphore.release()
@@ -0,0 +1,91 @@
+# ------------------------------------------------------------
+# Per-process token usage and prompt-prefix reuse counters for the local and remote backends.
+# Used by the benchmarks to compare prompting strategies on the same batch.
+# ------------------------------------------------------------
+import hashlib
+import threading
+from collections import defaultdict
+
+_usage = defaultdict(lambda: defaultdict(int))
+_usage_lock = threading.Lock()
+_seen_prefixes = set()
+
+
+def estimate_tokens(text):
+    # Rough but model-independent: ~4 characters per token for English text
+    return len(text) // 4
+
+
+def record_usage(backend, prompt_tokens=0, completion_tokens=0, seconds=0.0, cached_prompt_tokens=0):
+    with _usage_lock:
+        counters = _usage[backend]
+        counters["calls"] += 1
+        counters["prompt_tokens"] += prompt_tokens or 0
+        counters["completion_tokens"] += completion_tokens or 0
+        counters["cached_prompt_tokens"] += cached_prompt_tokens or 0  # As reported by the server, when it does
+        counters["seconds"] += seconds or 0.0
+
+
+def record_prefix(backend, prefix, reused_tokens=None):
+    """
+    Counts whether this static prompt prefix was already sent by this process, i.e. whether the
+    server had the chance to serve its prefill from the KV/prefix cache.
+
+    Args:
+        reused_tokens (int): Exact number of prefix tokens skipped (e.g. a reused Ollama context);
+            estimated from the prefix length when not known.
+    """
+    if not prefix:
+        return False
+    key = (backend, hashlib.sha1(prefix.encode("utf-8")).hexdigest())
+    with _usage_lock:
+        counters = _usage[backend]
+        hit = key in _seen_prefixes
+        if hit:
+            counters["prefix_hits"] += 1
+            counters["prefix_tokens_reused"] += reused_tokens if reused_tokens is not None else estimate_tokens(prefix)
+        else:
+            _seen_prefixes.add(key)
+            counters["prefix_misses"] += 1
+        return hit
+
+
+def get_usage(backend=None):
+    """
+    Returns a copy of the counters for one backend, or {backend: counters} for all of them.
+    """
+    with _usage_lock:
+        if backend is not None:
+            return dict(_usage[backend])
+        return {name: dict(counters) for name, counters in _usage.items()}
+
+
+def reset_usage():
+    with _usage_lock:
+        _usage.clear()
+        _seen_prefixes.clear()
+
+
+def format_usage(counters):
+    total = counters.get("prompt_tokens", 0) + counters.get("completion_tokens", 0)
+    return (
+        f"{counters.get('calls', 0)} calls, {total} tokens "
+        f"({counters.get('prompt_tokens', 0)} prompt / {counters.get('completion_tokens', 0)} completion)"
+    )
+
+
+def format_prefix_stats(counters):
+    hits = counters.get("prefix_hits", 0)
+    lookups = hits + counters.get("prefix_misses", 0)
+    text = (
+        f"prefix reuse {hits}/{lookups} calls ({hits / lookups if lookups else 0:.0%}), "
+        f"~{counters.get('prefix_tokens_reused', 0)} prefill tokens reusable"
+    )
+    if counters.get("cached_prompt_tokens"):
+        text += f", {counters['cached_prompt_tokens']} prompt tokens served from the server's cache"
+    return text
+
+
+def print_usage_stats(label=""):
+    for backend, counters in get_usage().items():
+        print(f"🧩 {label}{backend}: {format_usage(counters)}; {format_prefix_stats(counters)}")
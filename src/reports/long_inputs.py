@@ -0,0 +1,77 @@
+# ------------------------------------------------------------
+# Token-aware chunking of long section inputs (e.g. every OCR'd line of an Epic report).
+# Inputs that do not fit one request are split into chunks, each chunk is condensed by a
+# "map" call and the partial summaries are merged by a final "reduce" call (see section_runner).
+# ------------------------------------------------------------
+import os
+from llm_usage import estimate_tokens
+from ai_instructions import get_static_prefix, get_map_prefix
+
+# Input budget per request, in tokens
+CONTEXT_TOKENS = {
+    # Ollama's num_ctx (sent with every request, see ai_configuration_local)
+    "local": int(os.getenv("NHORA_OLLAMA_NUM_CTX", "8192")),
+    # The Groq models have large contexts, but on-demand tiers limit tokens per minute far below that
+    "remote": int(os.getenv("NHORA_GROQ_MAX_INPUT_TOKENS", "6000")),
+}
+# Room left in the context for the generated text
+OUTPUT_RESERVE_TOKENS = int(os.getenv("NHORA_OUTPUT_RESERVE_TOKENS", "1024"))
+MIN_CHUNK_TOKENS = 256
+
+
+def input_token_budget(backend, section):
+    """
+    Tokens available for the patient payload of one request to this backend.
+    """
+    static_tokens = max(estimate_tokens(get_static_prefix(section)), estimate_tokens(get_map_prefix(section)))
+    return max(MIN_CHUNK_TOKENS, CONTEXT_TOKENS[backend] - OUTPUT_RESERVE_TOKENS - static_tokens)
+
+
+def input_lines(filled_values):
+    """
+    Flattens section input into lines: lists (OCR lines) line by line, other fields as "field: value".
+    """
+    if isinstance(filled_values, dict):
+        for field, value in filled_values.items():
+            if isinstance(value, (list, tuple)):
+                yield from (str(item) for item in value)
+            else:
+                yield f"{field}: {value}"
+    elif isinstance(filled_values, (list, tuple)):
+        yield from (str(item) for item in filled_values)
+    else:
+        yield from str(filled_values).splitlines()
+
+
+def chunk_lines(lines, max_tokens):
+    """
+    Packs lines into consecutive chunks of at most max_tokens (estimated). Lines longer than a
+    chunk are split by characters.
+
+    Returns:
+        list: Chunk texts, one line per source line.
+    """
+    max_chars = max_tokens * 4
+    chunks, current, size = [], [], 0
+    for line in lines:
+        for piece in (line[i:i + max_chars] for i in range(0, max(len(line), 1), max_chars)):
+            tokens = estimate_tokens(piece) + 1
+            if current and size + tokens > max_tokens:
+                chunks.append("\n".join(current))
+                current, size = [], 0
+            current.append(piece)
+            size += tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def split_long_input(filled_values, section, backend):
+    """
+    Returns the chunks of a section input that is too long for one request, or None if it fits.
+    """
+    budget = input_token_budget(backend, section)
+    if estimate_tokens(str(filled_values)) <= budget:
+        return None
+    chunks = chunk_lines(input_lines(filled_values), budget)
+    return chunks if len(chunks) > 1 else None
@@ -1,16 +1,25 @@
-# Use this file for multiporcessing of several filesimport os
+# Use this file for multiporcessing of several files
+import os
+import argparse
 import multiprocessing
 from pathlib import Path
 from extract_neuropsych_form import extract_pdf_form_data, extract_sections, load_field_to_section_map
-from ai_configuration_local import get_local_response
-from ai_configuration_remote import get_remote_response
-from ai_instructions import get_ai_instruction
-from report_renderer import render_summary_html
+from ai_configuration_local import get_local_response, get_local_session, stream_local_response
+from report_renderer import render_summary_html, write_summary_html, report_output_path, report_file_path, write_report_file, copy_report_file, COMPRESS_REPORTS
+from pdf_source import is_pdf_data
+from report_store import content_hash, report_key, get_stored_report, iter_stored_report, store_report, store_report_file, group_by_content
 from patient_details import get_patient_info
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from response_cache import print_cache_stats
+from llm_usage import print_usage_stats
+from section_scheduler import run_section_major, sections_per_minute
+from batch_manifest import BatchManifest, MANIFEST_NAME, file_hash, make_fingerprint, split_pending
+from ai_configuration_local import local_summary_model
+from section_store import generate_changed_sections, section_store_path, report_skipped_sections, partition_batch, merge_batch
+from llm_limiter import create_llm_semaphores, init_llm_limiter, LLM_CONCURRENCY
+from section_runner import generate_sections, generate_sections_combined, report_section_errors, stream_sections, collect_section_events, report_stream_stats, publish
 
-import os
 import time
+from functools import partial
 
 # Root folder to search for PDFs
 ROOT_DIR = Path('../../data/np_hx/patients-np-hx-only')
@@ -20,78 +29,316 @@ TARGET_SECTIONS = ['Background Info Header',
                    'Birth & Development History',
                    'School History',
                    'Family History']
+# Stream tokens from the model: reports time-to-first-token and stops runaway generations early
+STREAM_SECTIONS = os.getenv("NHORA_STREAM_SECTIONS", "0") == "1"
+# "sections": one LLM call per section; "combined": one structured call per patient with per-section fallback
+GENERATION_MODE = os.getenv("NHORA_GENERATION_MODE", "sections")
+# "patient": each worker runs all sections of one patient; "section": all patients' calls grouped by section
+SCHEDULE = os.getenv("NHORA_SCHEDULE", "patient")
+
+def effective_mode(stream, mode):
+    # Streaming always makes one call per section, whatever mode says
+    return "sections" if stream else mode
+
+def extract_patient(fpath):
+    filled_values = extract_pdf_form_data(fpath)
+    field_section_map = load_field_to_section_map()  # Compiled once per worker process
+    extracted_data = extract_sections(filled_values, TARGET_SECTIONS, field_section_map)
+    return filled_values, extracted_data
+
+def render_patient(fpath, filled_values, section_data, name=None, compress=COMPRESS_REPORTS):
+    # Written next to the PDF as <pdf name>.html; fpath is None for in-memory uploads (nothing is written)
+    patient_info = get_patient_info(filled_values)
+    report_name = Path(name or fpath).with_suffix(".html").name
+    html_content = render_summary_html(section_data, fpath, patient_info, TARGET_SECTIONS, output_filename=report_name, compress=compress)
+    return report_name, html_content
+
+def render_patient_to_file(fpath, filled_values, section_data, compress=COMPRESS_REPORTS):
+    # Pool job: the report is streamed to disk and only its path goes back to the parent (None if rendering failed)
+    try:
+        report_name = Path(fpath).with_suffix(".html").name
+        return write_summary_html(section_data, fpath, get_patient_info(filled_values), TARGET_SECTIONS,
+                                  output_filename=report_name, compress=compress)
+    except Exception as e:
+        print(f"❌ Failed to render {fpath}: {e}")
+        return None
 
 # -----------------------------------------------------------------------
 # Parallelize each section of the report. Since this function involves making a remote API call, which is likely I/O-bound 
 # (and potentially slow due to network latency), parallelizing this function using threading would work well to speed things up.
 # -----------------------------------------------------------------------
-def process_pdf(fpath):
+def process_pdf(fpath, stream=STREAM_SECTIONS, mode=GENERATION_MODE, name=None):
+    result = process_pdf_with_errors(fpath, stream, mode, name=name)
+    return result[:2] if result else None
+
+def process_pdf_with_events(fpath, events, stream=STREAM_SECTIONS, mode=GENERATION_MODE, name=None, job_id=None):
+    """
+    Pool job for interactive front ends: publishes each section to events (a Manager queue) as soon as
+    it is ready, tagged with job_id (default: the PDF name or path). Token events stay in the worker.
+    """
+    tag = job_id or name or str(fpath)
+
+    def put_event(event):
+        if event["type"] != "token":
+            events.put({"pdf": tag, **event})
+
+    result = process_pdf_with_errors(fpath, stream, mode, on_event=put_event, name=name)
+    return result[:2] if result else None
+
+def process_pdf_with_errors(fpath, stream=STREAM_SECTIONS, mode=GENERATION_MODE, on_event=None, name=None, use_report_store=True, compress=COMPRESS_REPORTS, doc_hash=None, return_html=True):
+    """
+    Args:
+        fpath: Path of the PDF, or its bytes (in-memory upload, parsed without touching the disk).
+        name (str): File name of an in-memory upload, used for the report name and logs.
+        use_report_store (bool): Return the stored report of an identical, already processed document.
+        compress (bool): Write the report as .html.gz.
+        doc_hash (str): Content hash of the PDF when the caller already has it (computed here otherwise).
+        return_html (bool): Return the report HTML. When False (batch workers) the report is streamed
+            to its file and never held in memory whole; the HTML in the result is None.
+    """
+    # In-memory uploads have no file to write: their report is only ever returned
+    return_html = return_html or is_pdf_data(fpath)
     start_time = time.time()
+    mode = effective_mode(stream, mode)
+    in_memory = is_pdf_data(fpath)
+    label = name or ("upload.pdf" if in_memory else fpath)
+    # Uploads have no folder to keep a section store in: every section is generated
+    store_path = None if in_memory else section_store_path(fpath)
     try:
-        filled_values = extract_pdf_form_data(fpath)
-        field_section_map = load_field_to_section_map()
-        extracted_data = extract_sections(filled_values, TARGET_SECTIONS, field_section_map)
-
-        section_data = {}
-
-        # ThreadPoolExecutor handles remote API calls concurrently
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            # ## REMOTE MODEL
-            # # Submit tasks and map futures to sections
-            # future_to_section = {
-            #     executor.submit(get_remote_response, get_ai_instruction(data, section)): section
-            #     for section, data in extracted_data.items()
-            # }
-
-            ## LOCAL MODEL
-            # Submit tasks and map futures to sections
-            future_to_section = {
-                executor.submit(get_local_response, get_ai_instruction(data, section)): section
-                for section, data in extracted_data.items()
-            }
-
-            # Store completed results temporarily
-            temp_results = {}
-
-            # Collect results as they complete
-            for future in as_completed(future_to_section):
-                section = future_to_section[future]
-                try:
-                    temp_results[section] = future.result()
-                except Exception as e:
-                    temp_results[section] = f"Error: {e}"
-
-        # Reconstruct ordered section_data based on original extracted_data keys
-        section_data = {section: temp_results.get(section, "Missing") for section in extracted_data}
+        # An identical document was already processed with the same mapping, prompts and model
+        key = document_report_key(doc_hash or content_hash(fpath), mode)
+        stored = None
+        if use_report_store:
+            stored = get_stored_report(key) if return_html else iter_stored_report(key)
+        if stored is not None:
+            print(f"♻️ {Path(label).name}: identical document already processed, returning its stored report")
+            report_name = Path(label).with_suffix(".html").name
+            if not in_memory:
+                write_report_file(stored, report_output_path(fpath, report_name), compress)
+            return report_name, stored if return_html else None, {}
+
+        filled_values, extracted_data = extract_patient(fpath)
+
+        # Section calls run concurrently under a per-patient deadline
+        ## REMOTE MODEL: generate_sections(data, get_remote_response) / stream_sections(data, stream_remote_response)
+        ## LOCAL MODEL
+        def generate(data):
+            if on_event:
+                on_event({"type": "start", "sections": list(data)})
+            if stream:
+                section_data, section_errors, stream_stats = collect_section_events(
+                    stream_sections(data, stream_local_response), data, on_event=on_event
+                )
+                report_stream_stats(Path(label).name, stream_stats)
+                return section_data, section_errors
+            elif mode == "combined":
+                combined_start = time.monotonic()
+                section_data, section_errors = generate_sections_combined(data, get_local_response)
+                for section, text in section_data.items():
+                    publish(on_event, section, combined_start, text=text, error=section_errors.get(section))
+                return section_data, section_errors
+            else:
+                return generate_sections(data, get_local_response, backend="local", on_event=on_event)
+
+        # Only sections whose input fields changed since the last run go to the LLM
+        section_data, section_errors, skipped = generate_changed_sections(
+            extracted_data, generate, store_path, local_summary_model, mode
+        )
+        report_skipped_sections(Path(label).name, skipped, len(extracted_data))
+        report_section_errors(Path(label).name, section_errors)
 
         # Render the summary after processing all sections
-        patient_info = get_patient_info(filled_values)
-        html_content = render_summary_html(section_data, fpath, patient_info, TARGET_SECTIONS)
+        if return_html:
+            name, html_content = render_patient(None if in_memory else fpath, filled_values, section_data, name=label, compress=compress)
+            if not section_errors:
+                store_report(key, html_content)
+        else:
+            name, html_content = Path(label).with_suffix(".html").name, None
+            output_file = write_summary_html(section_data, fpath, get_patient_info(filled_values), TARGET_SECTIONS,
+                                             output_filename=name, compress=compress)
+            if not section_errors:
+                store_report_file(key, output_file)
         elapsed = time.time() - start_time
-        print(f"✅ Processed: {fpath} in {elapsed:.2f} seconds")
-        return Path(fpath).with_suffix(".html").name, html_content
+        print(f"✅ Processed: {label} in {elapsed:.2f} seconds")
+        print_usage_stats(label=f"worker {os.getpid()} so far - ")
+        return name, html_content, section_errors
     except Exception as e:
         elapsed = time.time() - start_time
-        print(f"❌ Failed to process {fpath} after {elapsed:.2f} seconds: {e}")
+        print(f"❌ Failed to process {label} after {elapsed:.2f} seconds: {e}")
+
+def process_pdf_status(job, use_report_store=True, compress=COMPRESS_REPORTS):
+    """
+    Batch pool job: the worker writes the report itself and returns only a small status record,
+    so the parent's memory does not grow with the batch.
+
+    Args:
+        job (tuple): (PDF path, its content hash from find_all_pdfs)
+    """
+    fpath, doc_hash = job
+    start_time = time.time()
+    result = process_pdf_with_errors(fpath, use_report_store=use_report_store, compress=compress, doc_hash=doc_hash, return_html=False)
+    status = {"pdf": str(fpath), "ok": False, "output": None, "section_errors": None, "seconds": 0.0}
+    if result:
+        name, _, section_errors = result
+        status.update(ok=not section_errors, output=report_file_path(fpath, name, compress), section_errors=len(section_errors))
+    status["seconds"] = time.time() - start_time
+    return status
+
+# -----------------------------------------------------------------------
+# Section-major batch: extract everything on every core, then send all calls for one
+# section back to back so consecutive requests share a prompt prefix, then render on every core.
+# -----------------------------------------------------------------------
+def extract_patient_safe(fpath):
+    try:
+        return fpath, *extract_patient(fpath)
+    except Exception as e:
+        print(f"❌ Failed to extract {fpath}: {e}")
+        return None
+
+def process_batch_section_major(pool, pdf_files, compress=COMPRESS_REPORTS):
+    extracted = [result for result in pool.map(extract_patient_safe, pdf_files) if result]
+
+    patients = {str(fpath): extracted_data for fpath, _, extracted_data in extracted}
+
+    # Only sections whose input fields changed since the last run are scheduled
+    stores, changed, reused, hashes = partition_batch(
+        patients, {str(fpath): section_store_path(fpath) for fpath, _, _ in extracted}, local_summary_model
+    )
+    print(f"♻️ Reused {sum(len(sections) for sections in reused.values())} sections with unchanged inputs")
+
+    generated, section_errors, stats = run_section_major(
+        changed, get_local_response, max_workers=LLM_CONCURRENCY["local"], section_order=TARGET_SECTIONS,
+        backend="local"
+    )
+    section_data = merge_batch(patients, stores, generated, reused, hashes, section_errors)
+    for patient_id, errors in section_errors.items():
+        report_section_errors(Path(patient_id).name, errors)
+    print(f"🤖 {stats['sections']}/{stats['scheduled']} section calls succeeded in {stats['seconds']:.2f} seconds "
+          f"({stats['sections_per_minute']:.1f} sections/minute)")
+
+    output_files = pool.starmap(render_patient_to_file, [
+        (fpath, filled_values, section_data[str(fpath)], compress) for fpath, filled_values, _ in extracted
+    ])
+    outputs = {fpath: output for (fpath, _, _), output in zip(extracted, output_files)}
+    # Patients that extracted, rendered and got every section count as done
+    return [fpath for fpath, _, _ in extracted if outputs[fpath] and not section_errors[str(fpath)]], outputs
 
 
 def find_all_pdfs(root_dir):
-    return [file for file in root_dir.rglob('*.pdf')]
+    """
+    Each PDF is hashed here only; the hashes are reused for fingerprints and report store keys.
+
+    Returns:
+        tuple: (PDFs with distinct content, {copy: the PDF it duplicates}, {PDF: content hash})
+    """
+    return group_by_content(list(root_dir.rglob('*.pdf')), file_hash)
 
-def main():
+def document_fingerprint(doc_hash, mode=GENERATION_MODE):
+    return make_fingerprint(doc_hash, local_summary_model, mode, target_sections=TARGET_SECTIONS)
+
+def document_report_key(doc_hash, mode=GENERATION_MODE):
+    return report_key(document_fingerprint(doc_hash, mode))
+
+def write_duplicate_report(copy, source_file, key, compress=COMPRESS_REPORTS):
+    """
+    Writes a copy's report from its original's report file, or from the report store when that file is gone.
+
+    Returns:
+        str: The written path, or None if there was nothing to copy.
+    """
+    name = copy.with_suffix(".html").name
+    try:
+        if source_file and os.path.exists(source_file):
+            # Same format as the original, so a .gz name always holds gzip data
+            return copy_report_file(source_file, report_file_path(copy, name, source_file.endswith(".gz")))
+        stored = get_stored_report(key)
+        if stored is not None:
+            return write_report_file(stored, report_output_path(copy, name), compress)
+    except OSError as e:
+        print(f"❌ Failed to write the report of {copy}: {e}")
+    return None
+
+def record_duplicate_reports(manifest, duplicates, done, outputs, fingerprints, compress=COMPRESS_REPORTS):
+    """
+    Gives every copy of a done PDF its original's report under its own name, whether the original
+    was processed in this run or an earlier one, and only then marks the copy done.
+    Copies share their original's fingerprint (same content), so also its report store key.
+    """
+    for copy, original in duplicates.items():
+        if original not in done or manifest.is_current(copy, fingerprints[original]):
+            continue
+        source_file = outputs.get(original) or manifest.output_of(original)
+        output = write_duplicate_report(copy, source_file, report_key(fingerprints[original]), compress)
+        manifest.mark_done(copy, fingerprints[original], output)
+
+def main(schedule=SCHEDULE, force=False, compress=COMPRESS_REPORTS):
     total_start = time.time()
-    pdf_files = find_all_pdfs(ROOT_DIR)
+    all_pdf_files, duplicates, hashes = find_all_pdfs(ROOT_DIR)
+
+    # Only new or changed patients (input, mapping, prompts or model) are processed again
+    manifest = BatchManifest(ROOT_DIR / MANIFEST_NAME)
+    # Section-major runs always make one call per section, whatever GENERATION_MODE says
+    mode = "sections" if schedule == "section" else effective_mode(STREAM_SECTIONS, GENERATION_MODE)
+    pdf_files, unchanged, fingerprints = split_pending(
+        manifest, all_pdf_files, lambda fpath: document_fingerprint(hashes[fpath], mode), force=force
+    )
+
+    print(f"Found {len(all_pdf_files) + len(duplicates)} PDFs ({len(duplicates)} duplicate copies share one job). "
+          f"Skipping {len(unchanged)} unchanged. Processing {len(pdf_files)}...")
+    if not pdf_files:
+        # Copies added since their original was processed still need their report
+        record_duplicate_reports(manifest, duplicates, set(unchanged), {}, fingerprints, compress)
+        manifest.save()
+        return
+
+    # Load the local model once for the whole batch; every worker then finds it resident
+    load_seconds = get_local_session().load()
+    print(f"🧠 Local model ready in {load_seconds:.2f} seconds")
 
-    print(f"Found {len(pdf_files)} PDFs. Processing...")
+    # Every core extracts and renders, but LLM requests are capped machine-wide per backend
+    print(f"🚦 LLM concurrency limits: {LLM_CONCURRENCY}")
+    semaphores = create_llm_semaphores()
+    init_llm_limiter(semaphores)  # The parent sends the calls itself in section-major mode
+    with multiprocessing.Pool(processes=multiprocessing.cpu_count(), initializer=init_llm_limiter, initargs=(semaphores,)) as pool:
+        if schedule == "section":
+            completed, outputs = process_batch_section_major(pool, pdf_files, compress)
+        else:
+            # Workers write the reports; only status records come back, in completion order
+            completed, outputs = [], {}
+            job = partial(process_pdf_status, use_report_store=not force, compress=compress)
+            jobs = [(fpath, hashes[fpath]) for fpath in pdf_files]
+            for i, status in enumerate(pool.imap_unordered(job, jobs), 1):
+                fpath = Path(status["pdf"])
+                outputs[fpath] = status["output"]
+                if status["ok"]:
+                    completed.append(fpath)
+                print(f"📄 [{i}/{len(pdf_files)}] {'✅' if status['ok'] else '❌'} {fpath.name} "
+                      f"-> {status['output'] or 'no report'} ({status['seconds']:.2f}s)")
 
-    with multiprocessing.Pool(processes=multiprocessing.cpu_count()) as pool:
-        pool.map(process_pdf, pdf_files)
+    # Patients with failed sections, or without a written report, stay pending so the next run retries them
+    recorded = sum(manifest.mark_done(fpath, fingerprints[fpath], outputs.get(fpath)) for fpath in completed)
+    done = set(completed) | set(unchanged)
+    record_duplicate_reports(manifest, duplicates, done, outputs, fingerprints, compress)
+    manifest.save()
+    print(f"🗂️ Manifest updated: {recorded}/{len(pdf_files)} patients completed")
 
     total_elapsed = time.time() - total_start
     print(f"\n🏁 All PDFs processed in {total_elapsed:.2f} seconds.")
+    # Same measure for both schedules, so runs can be compared directly
+    total_sections = len(pdf_files) * len(TARGET_SECTIONS)
+    print(f"📈 Throughput ({schedule}-major): {sections_per_minute(total_sections, total_elapsed):.1f} sections/minute")
+    print_cache_stats()
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Generate reports for every NP history form under ROOT_DIR")
+    parser.add_argument("--schedule", choices=["patient", "section"], default=SCHEDULE,
+                        help="patient-major (default) or section-major ordering of the LLM calls")
+    parser.add_argument("--force", action="store_true",
+                        help="reprocess every PDF, even those unchanged since the last run")
+    parser.add_argument("--gzip", action="store_true", default=COMPRESS_REPORTS,
+                        help="write reports as .html.gz")
+    args = parser.parse_args()
+    main(schedule=args.schedule, force=args.force, compress=args.gzip)
 
 # -----------------------------------------------------------------------
 # This is the standard call to generate each section of the report sequentially
@@ -1,15 +1,26 @@
+import os
 import time
+import argparse
 import multiprocessing
 from pathlib import Path
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from section_runner import generate_sections, report_section_errors
 
 from extract_neuropsych_form import extract_pdf_form_data, extract_sections, load_field_to_section_map
-from ai_configuration_remote import get_remote_response
-from ai_instructions import get_ai_instruction
-from report_renderer import render_summary_html
+from ai_configuration_remote import get_remote_response, remote_summarization_model
+from section_store import generate_changed_sections, section_store_path, report_skipped_sections, partition_batch, merge_batch
+from report_renderer import write_summary_html, report_file_path
 from patient_details import get_patient_info
-from extract_epic_data import extract_text_from_pdf, parse_epic_sections
+from response_cache import print_cache_stats
+from ocr_cache import print_ocr_cache_stats, take_ocr_cache_counters, merge_ocr_cache_counters
+from llm_usage import print_usage_stats
+from llm_limiter import LLM_CONCURRENCY
+from section_scheduler import run_section_major, sections_per_minute
+from batch_manifest import BatchManifest, MANIFEST_NAME, folder_hash, make_fingerprint, split_pending
+from extract_epic_data import extract_text_from_pdf, extract_epic_regions, parse_epic_sections, set_ocr_workers
+from extract_epic_data import print_page_source_stats, take_page_source_stats, merge_page_source_stats
+from staged_pipeline import run_staged_pipeline, report_pipeline_stats
+from patient_extraction import PatientExtraction, register_pdf_handler
 import pdb
 
 # --------------------------------------------------
@@ -25,22 +36,46 @@ TARGET_SECTIONS = [
     'Family History'
 ]
 
+# "patient": all sections of one patient at a time; "section": all patients' calls grouped by section
+SCHEDULE = os.getenv("NHORA_SCHEDULE", "patient")
+
+# Staged pipeline (patient schedule): OCR processes, patients in the LLM stage at once, queue capacity between stages
+EXTRACT_WORKERS = int(os.getenv("NHORA_EXTRACT_WORKERS", str(multiprocessing.cpu_count())))
+LLM_PATIENTS = int(os.getenv("NHORA_LLM_PATIENTS", "2"))
+STAGE_QUEUE_SIZE = int(os.getenv("NHORA_STAGE_QUEUE_SIZE", "4"))
+
+# "full": OCR every page of Epic reports; "regions": OCR only the EPIC_SECTIONS regions
+EPIC_OCR_MODE = os.getenv("NHORA_EPIC_OCR_MODE", "full")
+EPIC_SECTIONS = ["Reason for Referral"]
+
 # --------------------------------------------------
 # PDF-Type Routing
 # --------------------------------------------------
-PDF_TYPE_HANDLERS = {
-    "np_hx_form": lambda path: extract_sections(
-        extract_pdf_form_data(path),
-        TARGET_SECTIONS,
-        load_field_to_section_map()
-    ),
-    "epic_report": lambda path: {
+def extract_epic_report(pdf_path):
+    if EPIC_OCR_MODE == "regions":
+        sections = extract_epic_regions(pdf_path, EPIC_SECTIONS)
+        if sections:
+            return sections
+        # No header found (unusual layout): fall back to the whole document
+    return {
         "Reason for Referral": {
-            "text": extract_text_from_pdf(path)
+            "text": extract_text_from_pdf(pdf_path)
         }
-    },   
-    # Add more PDF types here
-}
+    }
+
+# Each document is parsed once per patient (see PatientExtraction); to_sections reuses that result
+PDF_TYPE_HANDLERS = {}
+register_pdf_handler(
+    PDF_TYPE_HANDLERS, "np_hx_form",
+    parse=extract_pdf_form_data,
+    to_sections=lambda form_data: extract_sections(form_data, TARGET_SECTIONS, load_field_to_section_map())
+)
+register_pdf_handler(
+    PDF_TYPE_HANDLERS, "epic_report",
+    parse=extract_epic_report,
+    to_sections=lambda sections: sections
+)
+# Add more PDF types here
 
 def identify_pdf_type(filename):
     for tag in PDF_TYPE_HANDLERS:
@@ -51,60 +86,95 @@ def identify_pdf_type(filename):
 # --------------------------------------------------
 # Core Processing Function
 # --------------------------------------------------
+def extract_patient_folder(folder_path):
+    """
+    Runs the matching extractor on every PDF of a patient folder.
+
+    Returns:
+        tuple: (section_data_raw, flat_form_data, extraction_stats) - sections merged across documents,
+            the flat np_hx_form values needed for the document header, and the page source and OCR cache
+            counters of this folder. Extraction may run in a worker process, so the counters travel
+            with the result; the parent adds them up with record_extraction_stats.
+    """
+    section_data_raw = defaultdict(dict)
+    extraction = PatientExtraction(PDF_TYPE_HANDLERS)
+
+    for pdf_path in folder_path.glob("*.pdf"):
+        pdf_type = identify_pdf_type(pdf_path.name)
+
+        if pdf_type not in PDF_TYPE_HANDLERS:
+            print(f"⚠️ Skipping unknown PDF type: {pdf_path.name}")
+            continue
+
+        try:
+            extracted = extraction.sections(pdf_type, pdf_path)
+
+            for section, data in extracted.items():
+                section_data_raw[section].update(data)
+        except Exception as e:
+            print(f"❌ Error extracting from {pdf_path.name}: {e}")
+
+    ## If the patient has a form, also keep the flat values since this is needed for the document header.
+    flat_form_data = extraction.raw("np_hx_form", default={})
+    extraction_stats = {"pages": take_page_source_stats(), "ocr_cache": take_ocr_cache_counters()}
+    return section_data_raw, flat_form_data, extraction_stats
+
+def record_extraction_stats(extracted):
+    # Called in the parent for every extracted folder, before the batch summary is printed
+    extraction_stats = extracted[2]
+    merge_page_source_stats(extraction_stats["pages"])
+    merge_ocr_cache_counters(extraction_stats["ocr_cache"])
+
+def render_patient_folder(folder_path, section_data, flat_form_data):
+    patient_info = get_patient_info(flat_form_data)
+
+    # Ensure "Reason for Referral" is the first section after all AI responses are gathered
+    if "Reason for Referral" in section_data:
+        reason_for_referral = section_data.pop("Reason for Referral")
+        section_data = {"Reason for Referral": reason_for_referral, **section_data}
+    
+    return write_summary_html(section_data, folder_path, patient_info, TARGET_SECTIONS)
+
+def generate_patient_folder(folder_path, extracted):
+    # First step in the parent to see a folder's extraction (the pipeline's extract stage runs in worker processes)
+    record_extraction_stats(extracted)
+    section_data_raw, _, _ = extracted
+
+    # Run remote AI calls concurrently under a per-patient deadline, only for sections whose inputs changed
+    return generate_changed_sections(
+        section_data_raw, lambda data: generate_sections(data, get_remote_response, backend="remote"),
+        section_store_path(folder_path), remote_summarization_model
+    )
+
+def finish_patient_folder(folder_path, extracted, generated):
+    """
+    Renders the report of a patient folder.
+
+    Returns:
+        tuple: (completed without section errors, number of section calls made)
+    """
+    section_data_raw, flat_form_data, _ = extracted
+    section_data, section_errors, skipped = generated
+    report_skipped_sections(folder_path.name, skipped, len(section_data_raw))
+    report_section_errors(folder_path.name, section_errors)
+
+    render_patient_folder(folder_path, section_data, flat_form_data)
+    return not section_errors, len(section_data_raw) - skipped
+
 def process_patient_folder(folder_path):
     start_time = time.time()
     try:
-        section_data_raw = defaultdict(dict)
-
-        for pdf_path in folder_path.glob("*.pdf"):
-            pdf_type = identify_pdf_type(pdf_path.name)
-            extractor = PDF_TYPE_HANDLERS.get(pdf_type)
-
-            if not extractor:
-                print(f"⚠️ Skipping unknown PDF type: {pdf_path.name}")
-                continue
-
-            try:
-                extracted = extractor(pdf_path)
-
-                if pdf_type == "np_hx_form":
-                    flat_form_data = extract_pdf_form_data(pdf_path) ## If the PDF is a form, also keep the flat values since this is needed for the document header.
-
-                for section, data in extracted.items():
-                    section_data_raw[section].update(data)
-            except Exception as e:
-                print(f"❌ Error extracting from {pdf_path.name}: {e}")
-
-        patient_info = get_patient_info(flat_form_data)
-        
-        # Run remote AI calls concurrently
-        section_data = {}
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            future_to_section = {
-                executor.submit(get_remote_response, get_ai_instruction(data, section)): section
-                for section, data in section_data_raw.items()
-            }
-
-            for future in as_completed(future_to_section):
-                section = future_to_section[future]
-                try:
-                    section_data[section] = future.result()
-                except Exception as e:
-                    section_data[section] = f"Error: {e}"
-
-        # Ensure "Reason for Referral" is the first section after all AI responses are gathered
-        if "Reason for Referral" in section_data:
-            reason_for_referral = section_data.pop("Reason for Referral")
-            section_data = {"Reason for Referral": reason_for_referral, **section_data}
-        
-        render_summary_html(section_data, folder_path, patient_info, TARGET_SECTIONS)
+        extracted = extract_patient_folder(folder_path)
+        completed, _ = finish_patient_folder(folder_path, extracted, generate_patient_folder(folder_path, extracted))
 
         elapsed = time.time() - start_time
         print(f"✅ Processed {folder_path.name} in {elapsed:.2f} seconds")
+        return completed
 
     except Exception as e:
         elapsed = time.time() - start_time
         print(f"❌ Failed to process {folder_path.name} after {elapsed:.2f} seconds: {e}")
+        return False
 
 # --------------------------------------------------
 # Main Entry Point
@@ -112,22 +182,105 @@ def process_patient_folder(folder_path):
 def find_all_patient_folders(root_dir):
     return [folder for folder in root_dir.iterdir() if folder.is_dir()]
 
-def main():
+def process_folders_section_major(patient_folders):
+    # Extract every folder first, then send all calls for one section back to back
+    extracted = {}
+    for folder in patient_folders:
+        try:
+            extracted[folder] = extract_patient_folder(folder)
+            record_extraction_stats(extracted[folder])
+        except Exception as e:
+            print(f"❌ Failed to extract {folder.name}: {e}")
+
+    patients = {str(folder): section_data_raw for folder, (section_data_raw, _, _) in extracted.items()}
+
+    # Only sections whose inputs changed since the last run are scheduled
+    stores, changed, reused, hashes = partition_batch(
+        patients, {str(folder): section_store_path(folder) for folder in extracted}, remote_summarization_model
+    )
+    print(f"♻️ Reused {sum(len(sections) for sections in reused.values())} sections with unchanged inputs")
+
+    generated, section_errors, stats = run_section_major(
+        changed, get_remote_response, max_workers=LLM_CONCURRENCY["remote"],
+        section_order=["Reason for Referral"] + TARGET_SECTIONS, backend="remote"
+    )
+    section_data = merge_batch(patients, stores, generated, reused, hashes, section_errors)
+    print(f"🤖 {stats['sections']}/{stats['scheduled']} section calls succeeded in {stats['seconds']:.2f} seconds "
+          f"({stats['sections_per_minute']:.1f} sections/minute)")
+
+    completed = []
+    for folder, (_, flat_form_data, _) in extracted.items():
+        report_section_errors(folder.name, section_errors[str(folder)])
+        try:
+            render_patient_folder(folder, section_data[str(folder)], flat_form_data)
+            if not section_errors[str(folder)]:
+                completed.append(folder)
+        except Exception as e:
+            print(f"❌ Failed to render {folder.name}: {e}")
+    return completed, stats["sections"]
+
+def init_extract_worker():
+    # Documents are already spread over EXTRACT_WORKERS processes: split the cores between them for page OCR
+    set_ocr_workers(max(1, multiprocessing.cpu_count() // EXTRACT_WORKERS))
+
+def process_folders_pipelined(patient_folders):
+    # OCR/parsing of the next folders overlaps with the LLM calls of the current ones
+    results, stats = run_staged_pipeline(
+        patient_folders, extract_patient_folder, generate_patient_folder, finish_patient_folder,
+        extract_workers=EXTRACT_WORKERS, llm_workers=LLM_PATIENTS, queue_size=STAGE_QUEUE_SIZE,
+        initializer=init_extract_worker
+    )
+    report_pipeline_stats(stats)
+    completed = [folder for folder, result in results.items() if result and result[0]]
+    return completed, sum(result[1] for result in results.values() if result)
+
+def folder_fingerprint(folder_path):
+    # Folders are always generated with one call per section
+    return make_fingerprint(folder_hash(folder_path), remote_summarization_model, "sections", target_sections=TARGET_SECTIONS)
+
+def main(schedule=SCHEDULE, force=False, debug=False):
     total_start = time.time()
-    patient_folders = find_all_patient_folders(ROOT_DIR)
+    all_patient_folders = find_all_patient_folders(ROOT_DIR)
 
-    print(f"Found {len(patient_folders)} patient folders. Processing...")
+    # Only new or changed patients (inputs, mapping, prompts or model) are processed again
+    manifest = BatchManifest(ROOT_DIR / MANIFEST_NAME)
+    patient_folders, unchanged, fingerprints = split_pending(manifest, all_patient_folders, folder_fingerprint, force=force)
 
-    # 🔧 DEBUG MODE: disable multiprocessing
-    for folder in patient_folders:
-        print(f"🔍 Debugging: {folder}")
-        process_patient_folder(folder)  # <— pdb.set_trace() will work here
+    print(f"Found {len(all_patient_folders)} patient folders. Skipping {len(unchanged)} unchanged. Processing {len(patient_folders)}...")
+
+    if schedule == "section":
+        completed, total_sections = process_folders_section_major(patient_folders)
+    elif debug:
+        # 🔧 DEBUG MODE: disable multiprocessing
+        completed, total_sections = [], 0
+        for folder in patient_folders:
+            print(f"🔍 Debugging: {folder}")
+            if process_patient_folder(folder):  # <— pdb.set_trace() will work here
+                completed.append(folder)
+            total_sections += len(TARGET_SECTIONS) + 1  # + Reason for Referral from the Epic report
+    else:
+        completed, total_sections = process_folders_pipelined(patient_folders)
 
-    # with multiprocessing.Pool(processes=multiprocessing.cpu_count()) as pool:
-    #     pool.map(process_patient_folder, patient_folders)
+    # Patients with failed sections, or without a written report, stay pending so the next run retries them
+    recorded = sum(manifest.mark_done(folder, fingerprints[folder], report_file_path(folder)) for folder in completed)
+    manifest.save()
+    print(f"🗂️ Manifest updated: {recorded}/{len(patient_folders)} patients completed")
 
     total_elapsed = time.time() - total_start
     print(f"\n🏁 All patients processed in {total_elapsed:.2f} seconds.")
+    print(f"📈 Throughput ({schedule}-major): {sections_per_minute(total_sections, total_elapsed):.1f} sections/minute")
+    print_usage_stats()
+    print_cache_stats()
+    print_ocr_cache_stats()
+    print_page_source_stats()
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description="Generate reports for every patient folder under ROOT_DIR")
+    parser.add_argument("--schedule", choices=["patient", "section"], default=SCHEDULE,
+                        help="patient-major (default) or section-major ordering of the LLM calls")
+    parser.add_argument("--force", action="store_true",
+                        help="reprocess every patient folder, even those unchanged since the last run")
+    parser.add_argument("--debug", action="store_true",
+                        help="process folders one at a time in this process (pdb-friendly)")
+    args = parser.parse_args()
+    main(schedule=args.schedule, force=args.force, debug=args.debug)
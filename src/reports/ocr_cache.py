@@ -0,0 +1,72 @@
+# ------------------------------------------------------------
+# Persistent cache of OCR results, one entry per PDF page.
+# Keyed by (document content hash, page index, DPI, grayscale, tesseract config) so rerunning the
+# multisource pipeline on the same Epic exports skips rasterization and tesseract entirely.
+# ------------------------------------------------------------
+import os
+import threading
+from disk_cache import DiskCache, make_cache_key
+
+# Set NHORA_OCR_CACHE=0 to OCR every page again
+OCR_CACHE_ENABLED = os.getenv("NHORA_OCR_CACHE", "1") != "0"
+OCR_CACHE_PATH = os.getenv("NHORA_OCR_CACHE_PATH", "../../.cache/ocr_pages.sqlite")
+OCR_CACHE_MAX_BYTES = int(os.getenv("NHORA_OCR_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+ocr_cache = DiskCache(OCR_CACHE_PATH, max_bytes=OCR_CACHE_MAX_BYTES)
+
+# Lookups of this run (the counters in the cache file cover every run). Extraction worker processes
+# hand theirs back with take_ocr_cache_counters so the parent can add them up.
+_lookups = {"hits": 0, "misses": 0}
+_lookups_lock = threading.Lock()
+
+
+def make_page_key(doc_hash, page_index, dpi, grayscale, tesseract_config):
+    return make_cache_key("ocr-page", doc_hash, page_index, dpi, grayscale, tesseract_config)
+
+
+def get_cached_page(doc_hash, page_index, dpi, grayscale, tesseract_config, use_cache=True):
+    """
+    Returns the stored OCR text of this page, or None.
+    """
+    if not (use_cache and OCR_CACHE_ENABLED):
+        return None
+    text = ocr_cache.get(make_page_key(doc_hash, page_index, dpi, grayscale, tesseract_config))
+    with _lookups_lock:
+        _lookups["misses" if text is None else "hits"] += 1
+    return text
+
+
+def store_page(doc_hash, page_index, dpi, grayscale, tesseract_config, text, use_cache=True):
+    # Blank pages are cached too ("" is a valid OCR result), failures never reach here
+    if not (use_cache and OCR_CACHE_ENABLED) or not isinstance(text, str):
+        return
+    ocr_cache.set(make_page_key(doc_hash, page_index, dpi, grayscale, tesseract_config), text)
+
+
+def take_ocr_cache_counters():
+    """
+    Returns this process's lookup counters and resets them (called at the end of a worker's job).
+    """
+    with _lookups_lock:
+        counters = dict(_lookups)
+        _lookups.update(hits=0, misses=0)
+    return counters
+
+
+def merge_ocr_cache_counters(counters):
+    with _lookups_lock:
+        for name, value in counters.items():
+            _lookups[name] += value
+
+
+def print_ocr_cache_stats():
+    stats = ocr_cache.stats()
+    with _lookups_lock:
+        hits, misses = _lookups["hits"], _lookups["misses"]
+    lookups = hits + misses
+    print(
+        f"💾 OCR page cache: {hits} hits, {misses} misses "
+        f"({hits / lookups if lookups else 0.0:.0%} hit rate), {stats['entries']} entries, "
+        f"{stats['bytes'] / (1024 * 1024):.1f}/{stats['max_bytes'] / (1024 * 1024):.0f} MB, "
+        f"{stats['evictions']} evictions"
+    )
@@ -0,0 +1,50 @@
+# ------------------------------------------------------------
+# Registry of source-document handlers and a per-patient memo of their results.
+# A handler is split in two steps:
+#   parse(path)        -> raw extraction (form fields, OCR lines, ...), the expensive part
+#   to_sections(raw)   -> {section: data} for the report
+# PatientExtraction parses each document once and hands the same raw result to every
+# consumer (sections, document header, ...), so new document types get memoization for free.
+# ------------------------------------------------------------
+from collections import defaultdict
+
+
+def register_pdf_handler(registry, tag, parse, to_sections):
+    """
+    Adds a document type to a handler registry.
+
+    Args:
+        registry (dict): The runner's PDF_TYPE_HANDLERS.
+        tag (str): Substring of the file name identifying the document type (e.g. "np_hx_form").
+        parse (callable): path -> raw extraction.
+        to_sections (callable): raw extraction -> {section: data}.
+    """
+    registry[tag] = {"parse": parse, "to_sections": to_sections}
+
+
+class PatientExtraction:
+    """
+    Cached extraction results for the source documents of one patient.
+    """
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self._parsed = {}        # (pdf_type, path) -> raw extraction
+        self._by_type = defaultdict(list)
+
+    def parse(self, pdf_type, pdf_path):
+        key = (pdf_type, str(pdf_path))
+        if key not in self._parsed:
+            self._parsed[key] = self.handlers[pdf_type]["parse"](pdf_path)
+            self._by_type[pdf_type].append(key)
+        return self._parsed[key]
+
+    def sections(self, pdf_type, pdf_path):
+        return self.handlers[pdf_type]["to_sections"](self.parse(pdf_type, pdf_path))
+
+    def raw(self, pdf_type, default=None):
+        """
+        Returns the raw extraction of the first parsed document of this type.
+        """
+        keys = self._by_type.get(pdf_type)
+        return self._parsed[keys[0]] if keys else default
@@ -0,0 +1,40 @@
+# ------------------------------------------------------------
+# PDFs reach the pipeline either as paths (batch runs) or as raw bytes (Streamlit uploads).
+# Form extraction parses bytes in memory; tools that need a real file (poppler for OCR) get a
+# scratch copy that is removed as soon as they are done.
+# ------------------------------------------------------------
+import os
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+
+
+def is_pdf_data(source):
+    return isinstance(source, (bytes, bytearray, memoryview)) or hasattr(source, "read")
+
+
+def read_pdf_bytes(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    if hasattr(source, "read"):
+        return source.read()
+    with open(source, "rb") as f:
+        return f.read()
+
+
+@contextmanager
+def materialized_pdf(source, name="upload.pdf"):
+    """
+    Yields a file path for source. Paths are passed through; bytes and buffers are written to a
+    private scratch directory that is deleted when the block exits, even on errors.
+    """
+    if not is_pdf_data(source):
+        yield source
+        return
+    with tempfile.TemporaryDirectory(prefix="nhora-") as scratch_dir:
+        path = os.path.join(scratch_dir, Path(name).name or "upload.pdf")
+        with open(path, "wb") as f:
+            f.write(read_pdf_bytes(source))
+        yield path
@@ -1,10 +1,34 @@
 # html_renderer.py
-from jinja2 import Template
+# Reports are rendered from templates/report.html.j2 (CSS in templates/static/report.css, inlined so
+# every report is a single self-contained file). The template is compiled once per process.
 import os
-import webbrowser
+import gzip
+import shutil
+import functools
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 
-def render_summary_html(section_data: dict, fpath: str, patient_info: dict, _target_sections: list, output_filename="ai_generated_report.html"):
-    # Get the directory from the input file path    
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+REPORT_TEMPLATE = "report.html.j2"
+# Write reports as .html.gz (set NHORA_GZIP_REPORTS=1 or pass compress=True)
+COMPRESS_REPORTS = os.getenv("NHORA_GZIP_REPORTS", "0") == "1"
+
+
+@functools.lru_cache(maxsize=None)
+def get_environment():
+    return Environment(
+        loader=FileSystemLoader(TEMPLATE_DIR),
+        autoescape=select_autoescape(["html", "j2"]),  # Section text comes from the LLM: always escaped
+        auto_reload=False,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def get_report_template():
+    return get_environment().get_template(REPORT_TEMPLATE)
+
+
+def report_output_path(fpath, output_filename="ai_generated_report.html"):
+    # Get the directory from the input file path
     # If it's already a file path (ends with .ext), use its directory
     if os.path.splitext(fpath)[1]:  # has an extension
         output_dir = os.path.dirname(fpath)
@@ -12,213 +36,96 @@ def render_summary_html(section_data: dict, fpath: str, patient_info: dict, _tar
         output_dir = fpath
 
     # Combine directory and output filename
-    output_file = os.path.join(output_dir, output_filename)
+    return os.path.join(output_dir, output_filename)
+
+
+def report_file_path(fpath, output_filename="ai_generated_report.html", compress=COMPRESS_REPORTS):
+    output_file = report_output_path(fpath, output_filename)
+    return output_file + ".gz" if compress else output_file
+
+
+def write_report_file(chunks, output_file, compress=COMPRESS_REPORTS):
+    """
+    Writes a report (a string or an iterable of string chunks) atomically: to a temporary file next to
+    the target first, then renamed over it, so readers never see a partial report.
+
+    Returns:
+        str: The written path (with .gz appended when compressed).
+    """
+    if compress and not output_file.endswith(".gz"):
+        output_file += ".gz"
+    tmp_path = f"{output_file}.{os.getpid()}.tmp"
+    try:
+        with (gzip.open(tmp_path, "wt", encoding="utf-8") if compress else open(tmp_path, "w", encoding="utf-8")) as f:
+            for chunk in ([chunks] if isinstance(chunks, str) else chunks):
+                f.write(chunk)
+        os.replace(tmp_path, output_file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return output_file
 
-    # Generate navigation links
-    nav_links = ""
-    html_sections = ""
 
-    # Define the order explicitly: Reason first, then your target sections
-    ordered_sections = ["Reason for Referral"] + _target_sections
+def copy_report_file(source_file, output_file):
+    # Same atomic rename as write_report_file, for copies of an identical document's report
+    tmp_path = f"{output_file}.{os.getpid()}.tmp"
+    try:
+        shutil.copyfile(source_file, tmp_path)
+        os.replace(tmp_path, output_file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return output_file
 
-    # Generate HTML in that specific order
+
+def report_sections(section_data, _target_sections):
+    """
+    [(section_id, section, text)] in report order: Reason first, then the target sections.
+    Missing sections are skipped but keep their index, so section ids are stable across patients.
+    """
+    ordered_sections = ["Reason for Referral"] + list(_target_sections or [])
+    sections = []
     for idx, section in enumerate(ordered_sections):
         result = section_data.get(section)
         if not result:
             continue  # Skip if that section wasn't included
-        section_id = f"section-{idx}"
-        nav_links += f'<li><a href="#{section_id}" class="nav-link">{section}</a></li>'
-        html_sections += f"""
-        <section class="content-section" id="{section_id}">
-            <h2>{section}</h2>
-            <pre>{result}</pre>
-        </section>
-        """
-
-    # for idx, (section, result) in enumerate(section_data.items()):
-    #     section_id = f"section-{idx}"
-    #     nav_links += f'<li><a href="#{section_id}" class="nav-link">{section}</a></li>'
-    #     html_sections += f"""
-    #     <section class="content-section" id="{section_id}">
-    #         <h2>{section}</h2>
-    #         <pre>{result}</pre>
-    #     </section>
-    #     """
-    # Patient Info Table
-    patient_info_html = """
-    <div class="patient-info">
-        <table style="width: 50%; border-collapse: collapse; margin-bottom: 20px;">
-            <tr><td>PATIENT NAME:</td><td>{{ patient_info['name'] }}</td></tr>
-            <tr><td>MEDICAL RECORD NO:</td><td>{{ patient_info['medical_record_no'] }}</td></tr>
-            <tr><td>DATE OF BIRTH:</td><td>{{ patient_info['date_of_birth'] }}</td></tr>
-            <tr><td>DATES OF SERVICE:</td><td>{{ patient_info['dates_of_service'] }}</td></tr>
-            <tr><td>AGE AT EVALUATION:</td><td>{{ patient_info['age_at_evaluation'] }}</td></tr>
-            <tr><td>EXAMINERS:</td><td>{{ patient_info['examiners'] | join('<br>') }}</td></tr>
-        </table>
-    </div>
+        sections.append((f"section-{idx}", section, result))
+    return sections
+
+
+def stream_summary_html(section_data: dict, patient_info: dict, _target_sections: list):
     """
-    
-    html_content = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Comprehensive Neuropsychological Evaluation</title>        
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0-beta3/css/all.min.css">
-        <style>
-            body {{
-                font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", "Roboto", "Helvetica Neue", sans-serif;
-                margin: 0;
-                padding: 0;
-                background-color: #f4f7fa;
-                color: #333;
-            }}
-            .container {{
-                display: flex;
-                max-width: 1100px;
-                margin: auto;
-            }}
-            .nav-pane {{
-                width: 240px;
-                background: rgba(108, 136, 177, 0.6);
-                color: #333;
-                padding: 10px;
-                position: fixed;
-                top: 0;
-                left: 0;
-                bottom: 0;
-                overflow-y: auto;
-                border-right: 1px solid rgba(0, 0, 0, 0.1);
-                box-shadow: 2px 0 5px rgba(0, 0, 0, 0.1);
-                transition: width 0.3s;
-            }}
-            .nav-pane a {{
-                color: #f9f9f9;
-                text-decoration: none;
-                font-size: 1em;
-                margin: 8px 0;
-                display: block;
-                padding: 6px 10px;
-                border-radius: 4px;
-                transition: background-color 0.3s;
-            }}
-            .nav-pane a:hover {{
-                background-color: rgba(0, 122, 255, 0.1);
-            }}            
-            .content {{
-                margin-left: 260px;
-                padding: 15px 25px;
-                flex: 1;
-            }}
-            ul li::marker {{
-              color: #f9f9f9;
-            }}
-            h1 {{
-                text-align: center;
-                color: #236eb9;
-                margin-bottom: 30px;
-                font-size: 2em;
-            }}
-            .content-section {{
-                background: rgba(255, 255, 255, 0.85); /* Translucent background */
-                padding: 15px;
-                border-radius: 8px;
-                box-shadow: 0 2px 8px rgba(0, 0, 0, 0.1);
-                margin-bottom: 20px;
-                transition: max-height 0.3s ease-out;
-            }}
-            h2 {{
-                color: #3e6897;
-                font-size: 1.6em;
-                margin-bottom: 10px;
-                cursor: pointer;
-                padding: 5px 0;
-                font-weight: 500;
-            }}
-            pre {{
-                white-space: pre-wrap;
-                background-color: #f6f8fa;
-                padding: 10px;
-                border-radius: 5px;
-                overflow-x: auto;
-                margin-top: 10px;
-                font-size: 1em;
-            }}
-            /* Add subtle hover effects for sections */
-            .content-section:hover {{
-                box-shadow: 0 4px 12px rgba(0, 0, 0, 0.1);
-            }}
-            @media (max-width: 768px) {{
-                .container {{
-                    flex-direction: column;
-                }}
-                .nav-pane {{
-                    width: 100%;
-                    position: relative;
-                    top: auto;
-                    left: auto;
-                    bottom: auto;
-                    box-shadow: none;
-                    border-right: none;
-                    padding: 15px;
-                }}
-                .content {{
-                    margin-left: 0;
-                    padding: 15px;
-                }}
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="nav-pane">
-            <h2>Table of Contents</h2>
-            <ul>
-                {nav_links}
-            </ul>
-        </div>
-        <div class="content">
-            <h1>Comprehensive Neuropsychological Evaluation</h1>
-            <h2>(Confidential)</h2>
-            {patient_info_html}
-            {html_sections}
-        </div>
-
-        <script>
-            // Add smooth scroll behavior for section navigation
-            document.querySelectorAll('.nav-link').forEach(link => {{
-                link.addEventListener('click', function(e) {{
-                    e.preventDefault();
-                    const target = document.querySelector(link.getAttribute('href'));
-                    window.scrollTo({{ top: target.offsetTop - 50, behavior: 'smooth' }});
-                }});
-            }});
-
-            // Expand/collapse sections
-            document.querySelectorAll('h2').forEach(h2 => {{
-                h2.addEventListener('click', function() {{
-                    const section = h2.closest('.content-section');
-                    const pre = section.querySelector('pre');
-                    if (pre.style.display === 'none') {{
-                        pre.style.display = 'block';
-                    }} else {{
-                        pre.style.display = 'none';
-                    }}
-                }});
-            }});
-        </script>
-    </body>
-    </html>
+    Yields the report HTML in pieces (template.generate), without building the whole document in memory.
     """
+    return get_report_template().generate(
+        sections=report_sections(section_data, _target_sections),
+        patient_info=patient_info,
+    )
 
-    # Render with Jinja2
-    template = Template(html_content)
-    rendered_html = template.render(patient_info=patient_info)
-    return rendered_html
 
-    # # Write rendered HTML to file
-    # with open(output_file, "w", encoding="utf-8") as f:
-    #     f.write(rendered_html)
+def write_summary_html(section_data: dict, fpath: str, patient_info: dict, _target_sections: list, output_filename="ai_generated_report.html", compress=COMPRESS_REPORTS):
+    """
+    Streams the report straight into its file, for callers that only need the file.
+
+    Returns:
+        str: The written path.
+    """
+    return write_report_file(
+        stream_summary_html(section_data, patient_info, _target_sections),
+        report_output_path(fpath, output_filename), compress
+    )
 
-    # webbrowser.open(f"file://{os.path.abspath(output_file)}")
 
+def render_summary_html(section_data: dict, fpath: str, patient_info: dict, _target_sections: list, output_filename="ai_generated_report.html", compress=COMPRESS_REPORTS):
+    # For callers that also need the HTML as a string (report store, display). fpath is None for
+    # in-memory uploads, which have no output location
+    output_file = report_output_path(fpath, output_filename) if fpath else None
+
+    rendered_html = "".join(stream_summary_html(section_data, patient_info, _target_sections))
+
+    # Write rendered HTML to file
+    if output_file:
+        write_report_file(rendered_html, output_file, compress)
+    return rendered_html
@@ -0,0 +1,102 @@
+# ------------------------------------------------------------
+# Finished reports keyed by document content, so an identical PDF (re-uploaded, or copied into
+# another batch folder) gets its stored report back instantly instead of a new extraction and
+# six LLM calls. The key also covers everything else that shapes a report (mapping, prompts,
+# model, generation mode, sections, and the report template and CSS; see batch_manifest.make_fingerprint),
+# so a changed template is never served stale.
+# ------------------------------------------------------------
+import os
+import gzip
+import shutil
+import hashlib
+from disk_cache import make_cache_key
+from batch_manifest import file_hash
+from pdf_source import is_pdf_data, read_pdf_bytes
+
+REPORT_STORE_DIR = os.getenv("NHORA_REPORT_STORE", "../../.cache/reports")
+
+
+def content_hash(source):
+    """
+    sha256 of a PDF given as a path, bytes or buffer.
+    """
+    if is_pdf_data(source):
+        return hashlib.sha256(read_pdf_bytes(source)).hexdigest()
+    return file_hash(source)
+
+
+def report_key(fingerprint):
+    return make_cache_key("report", fingerprint)
+
+
+def report_path(key, store_dir=REPORT_STORE_DIR):
+    return os.path.join(store_dir, f"{key}.html")
+
+
+def get_stored_report(key, store_dir=REPORT_STORE_DIR):
+    """
+    Returns the stored report HTML, or None.
+    """
+    try:
+        with open(report_path(key, store_dir), "r", encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def iter_stored_report(key, store_dir=REPORT_STORE_DIR, chunk_size=64 * 1024):
+    """
+    Returns the stored report as a generator of chunks (to stream into a file), or None.
+    """
+    path = report_path(key, store_dir)
+    if not os.path.exists(path):
+        return None
+
+    def chunks():
+        with open(path, "r", encoding="utf-8") as f:
+            yield from iter(lambda: f.read(chunk_size), "")
+    return chunks()
+
+
+def store_report_file(key, report_file, store_dir=REPORT_STORE_DIR):
+    # Copies an already written report (.html or .html.gz) into the store without reading it whole
+    os.makedirs(store_dir, exist_ok=True)
+    path = report_path(key, store_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with (gzip.open if report_file.endswith(".gz") else open)(report_file, "rb") as src, open(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def store_report(key, html_content, store_dir=REPORT_STORE_DIR):
+    # Written under a temporary name first, so a concurrent reader never sees half a report
+    os.makedirs(store_dir, exist_ok=True)
+    path = report_path(key, store_dir)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(html_content)
+    os.replace(tmp_path, path)
+
+
+def group_by_content(items, hash_of):
+    """
+    Groups batch items with identical content.
+
+    Returns:
+        tuple: (unique items in first-seen order, {duplicate: the unique item it copies}, {item: hash})
+    """
+    hashes = {item: hash_of(item) for item in items}
+    first_seen = {}
+    unique, duplicates = [], {}
+    for item in items:
+        if hashes[item] in first_seen:
+            duplicates[item] = first_seen[hashes[item]]
+        else:
+            first_seen[hashes[item]] = item
+            unique.append(item)
+    return unique, duplicates, hashes
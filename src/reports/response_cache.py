@@ -0,0 +1,44 @@
+# ------------------------------------------------------------
+# Persistent cache of LLM responses, shared by the local (Ollama) and remote (Groq) backends.
+# Keyed by (model name, prompt text, generation options) so re-rendering a batch after a
+# template tweak does not send a single prompt to the model again.
+# ------------------------------------------------------------
+import os
+from disk_cache import DiskCache, make_cache_key
+
+# Set NHORA_RESPONSE_CACHE=0 to bypass the cache for a whole run
+RESPONSE_CACHE_ENABLED = os.getenv("NHORA_RESPONSE_CACHE", "1") != "0"
+RESPONSE_CACHE_PATH = os.getenv("NHORA_RESPONSE_CACHE_PATH", "../../.cache/llm_responses.sqlite")
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("NHORA_RESPONSE_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+response_cache = DiskCache(RESPONSE_CACHE_PATH, max_bytes=RESPONSE_CACHE_MAX_BYTES)
+
+
+def make_response_key(model, prompt, options=None):
+    return make_cache_key("llm-response", model, prompt, options or {})
+
+
+def get_cached_response(model, prompt, options=None, use_cache=True):
+    """
+    Returns the stored response for this exact request, or None.
+    """
+    if not (use_cache and RESPONSE_CACHE_ENABLED):
+        return None
+    return response_cache.get(make_response_key(model, prompt, options))
+
+
+def store_response(model, prompt, response, options=None, use_cache=True):
+    # Only cache real text responses - error tuples and empty strings must be retried next run
+    if not (use_cache and RESPONSE_CACHE_ENABLED) or not isinstance(response, str) or not response:
+        return
+    response_cache.set(make_response_key(model, prompt, options), response)
+
+
+def print_cache_stats():
+    stats = response_cache.stats()
+    print(
+        f"💾 LLM response cache: {stats['hits']} hits, {stats['misses']} misses "
+        f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries, "
+        f"{stats['bytes'] / (1024 * 1024):.1f}/{stats['max_bytes'] / (1024 * 1024):.0f} MB, "
+        f"{stats['evictions']} evictions"
+    )
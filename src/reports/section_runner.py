@@ -0,0 +1,316 @@
+# ------------------------------------------------------------
+# Runs the LLM calls for all sections of one patient concurrently.
+# Since each call is I/O-bound (waiting on Ollama or Groq), a thread pool keeps them overlapped.
+# A per-patient deadline bounds the whole report: sections that have not finished by then are
+# cancelled and reported as structured errors instead of stalling the worker.
+# ------------------------------------------------------------
+import os
+import json
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ai_instructions import get_ai_instruction, get_combined_ai_instruction, get_combined_response_schema, get_map_instruction, get_reduce_instruction
+from long_inputs import split_long_input
+from llm_errors import LLMRequestError, DEADLINE, make_deadline, describe_error
+
+# Seconds allowed for all section calls of one patient
+PATIENT_DEADLINE_SECONDS = float(os.getenv("NHORA_PATIENT_DEADLINE", "900"))
+SECTION_THREADS = 5
+# Streaming generations longer than this are treated as runaway and stopped early
+MAX_SECTION_CHARS = int(os.getenv("NHORA_MAX_SECTION_CHARS", "8000"))
+
+
+def generate_sections(extracted_data, get_response, deadline_seconds=PATIENT_DEADLINE_SECONDS, max_workers=SECTION_THREADS, backend=None, on_event=None):
+    """
+    Generates the text of every section with get_response(prompt, deadline=...).
+    Sections whose input is too long for one request are map-reduced in the same thread pool:
+    their chunks are condensed concurrently, and a reduce call is queued as soon as the last one finishes.
+
+    Args:
+        extracted_data (dict): {section: fields} as returned by extract_sections.
+        get_response (callable): get_local_response or get_remote_response.
+        deadline_seconds (float): Time budget for the whole patient (None for no deadline).
+        backend (str): "local" or "remote", to size chunks for its context; None sends every input whole.
+        on_event (callable): Called with a "section" or "error" event (same shape as stream_sections)
+            as soon as each section is done, e.g. to show it before the whole report is ready.
+
+    Returns:
+        tuple: ({section: text}, {section: error record}) - both in the order of extracted_data.
+    """
+    deadline = make_deadline(deadline_seconds)
+    start = time.monotonic()
+    temp_results = {}
+    errors = {}
+    partials = {}  # section -> partial summaries of a map-reduced section, in chunk order
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        # Submit tasks and map futures to (section, chunk index or None for a whole-section call)
+        pending = {}
+        for section, data in extracted_data.items():
+            chunks = split_long_input(data, section, backend) if backend else None
+            if not chunks:
+                pending[executor.submit(get_response, get_ai_instruction(data, section), deadline=deadline)] = (section, None)
+                continue
+            print(f"✂️ {section}: input split into {len(chunks)} chunks for the {backend} backend")
+            partials[section] = [None] * len(chunks)
+            for index, chunk in enumerate(chunks):
+                prompt = get_map_instruction(chunk, section, index + 1, len(chunks))
+                pending[executor.submit(get_response, prompt, deadline=deadline)] = (section, index)
+
+        while pending:
+            done, _ = wait(pending, timeout=time_left(deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                # Deadline hit: cancel what has not started; running calls stop at their own (deadline-bounded) timeout
+                for future, (section, _) in pending.items():
+                    future.cancel()
+                    if section not in temp_results and section not in errors:
+                        errors[section] = LLMRequestError(DEADLINE, f"Section not finished within {deadline_seconds:g}s").to_dict()
+                        publish(on_event, section, start, error=errors[section])
+                break
+
+            for future in done:
+                section, index = pending.pop(future)
+                if section in errors:
+                    continue  # Another chunk of this section already failed
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors[section] = describe_error(e)
+                    publish(on_event, section, start, error=errors[section])
+                    continue
+                if index is None:
+                    temp_results[section] = result
+                    publish(on_event, section, start, text=result)
+                    continue
+                partials[section][index] = result if isinstance(result, str) else ""
+                if all(partial is not None for partial in partials[section]):
+                    prompt = get_reduce_instruction(partials[section], section)
+                    pending[executor.submit(get_response, prompt, deadline=deadline)] = (section, None)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    # Reconstruct ordered section_data based on original extracted_data keys
+    section_data = {}
+    for section in extracted_data:
+        if section in errors:
+            section_data[section] = f"Error: {errors[section]['message']}"
+        else:
+            section_data[section] = temp_results.get(section, "Missing")
+    return section_data, errors
+
+
+def publish(on_event, section, start, text=None, error=None):
+    if not on_event:
+        return
+    stats = {"seconds": time.monotonic() - start}
+    if error is not None:
+        on_event({"type": "error", "section": section, "error": error, "text": "", "stats": stats})
+    else:
+        on_event({"type": "section", "section": section, "text": text, "stats": stats})
+
+
+def time_left(deadline):
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+# ------------------------------------------------------------
+# Combined mode: one structured call per patient instead of one call per section
+# ------------------------------------------------------------
+def validate_combined_response(response, sections):
+    """
+    Parses the combined JSON response.
+
+    Returns:
+        tuple: ({section: text} for the sections that validated, [sections that did not])
+    """
+    try:
+        parsed = json.loads(response) if isinstance(response, str) else None
+    except json.JSONDecodeError:
+        parsed = None
+    if not isinstance(parsed, dict):
+        return {}, list(sections)
+
+    valid, failed = {}, []
+    for section in sections:
+        value = parsed.get(section)
+        if isinstance(value, str) and value.strip():
+            valid[section] = value.strip()
+        else:
+            failed.append(section)
+    return valid, failed
+
+
+def generate_sections_combined(extracted_data, get_response, deadline_seconds=PATIENT_DEADLINE_SECONDS, max_workers=SECTION_THREADS):
+    """
+    Generates every section with a single structured call, then falls back to per-section calls
+    (generate_sections) only for sections missing or empty in the combined answer.
+
+    Returns:
+        tuple: ({section: text}, {section: error record}) - same shape as generate_sections.
+    """
+    start = time.monotonic()
+    sections = list(extracted_data)
+    deadline = make_deadline(deadline_seconds)
+    try:
+        response = get_response(
+            get_combined_ai_instruction(extracted_data),
+            deadline=deadline,
+            response_format=get_combined_response_schema(sections)
+        )
+        valid, failed = validate_combined_response(response, sections)
+    except Exception as e:
+        print(f"⚠️ Combined call failed, falling back to per-section calls: {describe_error(e)['message']}")
+        valid, failed = {}, sections
+
+    errors = {}
+    if failed:
+        remaining = None if deadline_seconds is None else max(deadline_seconds - (time.monotonic() - start), 0)
+        fallback_data, errors = generate_sections(
+            {section: extracted_data[section] for section in failed}, get_response,
+            deadline_seconds=remaining, max_workers=max_workers
+        )
+        valid.update(fallback_data)
+
+    section_data = {section: valid.get(section, "Missing") for section in sections}
+    return section_data, errors
+
+
+def report_section_errors(name, errors):
+    for section, error in errors.items():
+        print(f"⚠️ {name} - {section}: {error['kind']} ({error['message']})")
+
+
+# ------------------------------------------------------------
+# Streaming mode: tokens are surfaced as they arrive
+# ------------------------------------------------------------
+def collect_stream(token_stream, on_token=None, max_chars=MAX_SECTION_CHARS, should_stop=None):
+    """
+    Reads a token generator to the end (or until it runs away) and times it.
+
+    Args:
+        token_stream: Generator from stream_local_response / stream_remote_response.
+        on_token (callable): Called with (token, text_so_far) for every piece.
+        max_chars (int): Stop the generation once the text grows beyond this.
+        should_stop (callable): Polled between tokens; returning True aborts the generation.
+
+    Returns:
+        tuple: (text, stats) where stats has ttft, seconds, chars and aborted (None or the reason).
+    """
+    start = time.time()
+    ttft = None
+    aborted = None
+    pieces = []
+    length = 0
+    try:
+        for token in token_stream:
+            if ttft is None:
+                ttft = time.time() - start
+            pieces.append(token)
+            length += len(token)
+            if on_token:
+                on_token(token, "".join(pieces))
+            if max_chars and length > max_chars:
+                aborted = f"runaway generation (> {max_chars} characters)"
+                break
+            if should_stop and should_stop():
+                aborted = "stopped"
+                break
+    finally:
+        token_stream.close()  # Releases the connection and the request slot right away
+    stats = {"ttft": ttft, "seconds": time.time() - start, "chars": length, "aborted": aborted}
+    return "".join(pieces), stats
+
+
+def stream_sections(extracted_data, stream_response, deadline_seconds=PATIENT_DEADLINE_SECONDS, max_workers=SECTION_THREADS, max_chars=MAX_SECTION_CHARS):
+    """
+    Streams all sections of one patient concurrently and yields events as they happen:
+
+        {"type": "token", "section": ..., "text": text_so_far}
+        {"type": "section", "section": ..., "text": final_text, "stats": {...}}
+        {"type": "error", "section": ..., "error": {...}, "text": partial_text}
+
+    Args:
+        extracted_data (dict): {section: fields} as returned by extract_sections.
+        stream_response (callable): stream_local_response or stream_remote_response.
+    """
+    deadline = make_deadline(deadline_seconds)
+    events = queue.Queue()
+    stop = threading.Event()
+
+    def run(section, data):
+        try:
+            text, stats = collect_stream(
+                stream_response(get_ai_instruction(data, section), deadline=deadline),
+                on_token=lambda token, text: events.put({"type": "token", "section": section, "text": text}),
+                max_chars=max_chars,
+                should_stop=stop.is_set
+            )
+            if stats["aborted"]:
+                error = {"kind": "aborted", "backend": None, "message": stats["aborted"]}
+                events.put({"type": "error", "section": section, "error": error, "text": text, "stats": stats})
+            else:
+                events.put({"type": "section", "section": section, "text": text, "stats": stats})
+        except Exception as e:
+            events.put({"type": "error", "section": section, "error": describe_error(e), "text": ""})
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = set(extracted_data)
+    try:
+        for section, data in extracted_data.items():
+            executor.submit(run, section, data)
+
+        while pending:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                event = events.get(timeout=timeout)
+            except queue.Empty:
+                stop.set()
+                for section in list(pending):
+                    error = LLMRequestError(DEADLINE, f"Section not finished within {deadline_seconds:g}s").to_dict()
+                    yield {"type": "error", "section": section, "error": error, "text": ""}
+                    pending.discard(section)
+                break
+            if event["type"] != "token":
+                pending.discard(event["section"])
+            yield event
+    finally:
+        stop.set()  # Consumer went away or deadline hit: running streams stop at their next token
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def collect_section_events(events, extracted_data, on_event=None):
+    """
+    Consumes stream_sections events into the same (section_data, errors) pair generate_sections returns,
+    plus the per-section streaming stats.
+    """
+    texts, errors, stats = {}, {}, {}
+    for event in events:
+        if on_event:
+            on_event(event)
+        if event["type"] == "section":
+            texts[event["section"]] = event["text"]
+            stats[event["section"]] = event["stats"]
+        elif event["type"] == "error":
+            errors[event["section"]] = event["error"]
+            if event.get("stats"):
+                stats[event["section"]] = event["stats"]
+            if event["text"]:
+                texts[event["section"]] = event["text"]  # Keep what was generated before the abort
+
+    section_data = {}
+    for section in extracted_data:
+        if section in texts:
+            section_data[section] = texts[section]
+        elif section in errors:
+            section_data[section] = f"Error: {errors[section]['message']}"
+        else:
+            section_data[section] = "Missing"
+    return section_data, errors, stats
+
+
+def report_stream_stats(name, stats):
+    for section, s in stats.items():
+        ttft = f"{s['ttft']:.2f}s" if s["ttft"] is not None else "n/a"
+        print(f"⏱️ {name} - {section}: first token {ttft}, done in {s['seconds']:.2f}s ({s['chars']} chars)")
@@ -0,0 +1,131 @@
+# ------------------------------------------------------------
+# Section-major scheduling for batch runs.
+# Instead of sending the six sections of one patient, then the six of the next, all
+# (patient, section) jobs are collected first and dispatched grouped by section, so
+# consecutive requests share the same static prompt prefix (see ai_instructions).
+# ------------------------------------------------------------
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ai_instructions import get_ai_instruction, get_map_instruction, get_reduce_instruction
+from long_inputs import split_long_input
+from llm_errors import LLMRequestError, DEADLINE, make_deadline, describe_error
+from section_runner import PATIENT_DEADLINE_SECONDS, time_left
+
+
+def build_section_major_jobs(patients, section_order=None):
+    """
+    Orders every (patient, section) pair by section first.
+
+    Args:
+        patients (dict): {patient_id: {section: fields}} as returned by extract_sections.
+        section_order (list): Preferred section order; sections not listed come after, in first-seen order.
+
+    Returns:
+        list: [(section, patient_id, fields)]
+    """
+    sections = list(section_order or [])
+    for extracted_data in patients.values():
+        for section in extracted_data:
+            if section not in sections:
+                sections.append(section)
+
+    return [
+        (section, patient_id, extracted_data[section])
+        for section in sections
+        for patient_id, extracted_data in patients.items()
+        if section in extracted_data
+    ]
+
+
+def run_section_major(patients, get_response, max_workers, section_order=None, deadline_seconds=PATIENT_DEADLINE_SECONDS, backend=None):
+    """
+    Runs all section calls of a batch grouped by section and reassembles them per patient.
+    The executor queue is FIFO, so requests reach the model in section-major order.
+    Inputs too long for one request are map-reduced as in generate_sections (backend sizes the chunks;
+    None sends every input whole): the chunk calls keep their place in the section-major order, and
+    the reduce call is queued once the last chunk of that patient's section is done.
+
+    A patient's calls are spread over the whole batch, so the patient-major deadline is applied two ways:
+    each call gets deadline_seconds from the moment it starts, and the batch as a whole gets
+    deadline_seconds per patient. Calls still pending then are cancelled and reported as deadline errors.
+
+    Returns:
+        tuple: ({patient_id: section_data}, {patient_id: {section: error record}}, stats)
+            section_data keeps each patient's original section order, as render_summary_html expects.
+            stats["sections"] counts the calls that succeeded, stats["scheduled"] all calls.
+    """
+    jobs = build_section_major_jobs(patients, section_order)
+    results = {patient_id: {} for patient_id in patients}
+    errors = {patient_id: {} for patient_id in patients}
+    batch_deadline = make_deadline(None if deadline_seconds is None else deadline_seconds * len(patients))
+
+    def call(prompt):
+        # The call's own deadline starts when it leaves the queue, capped by the batch deadline
+        deadline = make_deadline(deadline_seconds)
+        if batch_deadline is not None:
+            deadline = min(deadline, batch_deadline)
+        return get_response(prompt, deadline=deadline)
+
+    start = time.time()
+    partials = {}  # (patient_id, section) -> partial summaries of a map-reduced section, in chunk order
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        # futures -> (section, patient_id, chunk index or None for a whole-section call)
+        pending = {}
+        for section, patient_id, data in jobs:
+            chunks = split_long_input(data, section, backend) if backend else None
+            if not chunks:
+                pending[executor.submit(call, get_ai_instruction(data, section))] = (section, patient_id, None)
+                continue
+            print(f"✂️ {patient_id} - {section}: input split into {len(chunks)} chunks for the {backend} backend")
+            partials[(patient_id, section)] = [None] * len(chunks)
+            for index, chunk in enumerate(chunks):
+                prompt = get_map_instruction(chunk, section, index + 1, len(chunks))
+                pending[executor.submit(call, prompt)] = (section, patient_id, index)
+
+        while pending:
+            done, _ = wait(pending, timeout=time_left(batch_deadline), return_when=FIRST_COMPLETED)
+            if not done:
+                for future, (section, patient_id, _) in pending.items():
+                    future.cancel()
+                    errors[patient_id].setdefault(section, LLMRequestError(
+                        DEADLINE, f"Section not finished within the {deadline_seconds * len(patients):g}s batch deadline"
+                    ).to_dict())
+                break
+            for future in done:
+                section, patient_id, index = pending.pop(future)
+                if section in errors[patient_id]:
+                    continue  # Another chunk of this section already failed
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors[patient_id][section] = describe_error(e)
+                    continue
+                if index is None:
+                    results[patient_id][section] = result
+                    continue
+                chunk_results = partials[(patient_id, section)]
+                chunk_results[index] = result if isinstance(result, str) else ""
+                if all(partial is not None for partial in chunk_results):
+                    prompt = get_reduce_instruction(chunk_results, section)
+                    pending[executor.submit(call, prompt)] = (section, patient_id, None)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    elapsed = time.time() - start
+
+    section_data = {
+        patient_id: {
+            section: f"Error: {errors[patient_id][section]['message']}" if section in errors[patient_id]
+            else results[patient_id].get(section, "Missing")
+            for section in extracted_data
+        }
+        for patient_id, extracted_data in patients.items()
+    }
+    succeeded = sum(len(sections) for sections in results.values())
+    stats = {"sections": succeeded, "scheduled": len(jobs), "seconds": elapsed,
+             "sections_per_minute": sections_per_minute(succeeded, elapsed)}
+    return section_data, errors, stats
+
+
+def sections_per_minute(sections, seconds):
+    return sections / (seconds / 60) if seconds > 0 else 0.0
@@ -0,0 +1,139 @@
+# ------------------------------------------------------------
+# Section-level dependency tracking.
+# For every patient we keep the generated text of each section together with a hash of what
+# produced it (the section's input fields, its prompt prefix, the model and the generation mode). When a corrected
+# form is re-ingested only the sections whose inputs changed are sent to the LLM again.
+# ------------------------------------------------------------
+import os
+import json
+from pathlib import Path
+from datetime import datetime
+from disk_cache import make_cache_key
+from ai_instructions import get_static_prefix
+
+SECTION_STORE_NAME = ".nhora_sections.json"
+
+
+def section_store_path(source_path):
+    """
+    Store location for a patient: next to a single PDF (<name>.sections.json) or inside a patient folder.
+    """
+    source_path = Path(source_path)
+    if source_path.is_dir():
+        return source_path / SECTION_STORE_NAME
+    return source_path.with_suffix(".sections.json")
+
+
+def section_input_hash(section, fields, model, generation_mode):
+    # Per-section and combined calls use different prompts, so their outputs are never swapped
+    return make_cache_key("section", section, fields, get_static_prefix(section), model, generation_mode)
+
+
+class SectionStore:
+    """
+    {section: {"input_hash", "output", "updated_at"}} for one patient, persisted as JSON.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.sections = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.sections = json.load(f)
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"⚠️ Ignoring unreadable section store {self.path}: {e}")
+
+    def partition(self, extracted_data, model, generation_mode="sections"):
+        """
+        Splits a patient's sections into those that must be generated and those that can be reused.
+
+        Returns:
+            tuple: (changed {section: fields}, reused {section: stored text}, {section: input hash})
+        """
+        hashes = {section: section_input_hash(section, fields, model, generation_mode) for section, fields in extracted_data.items()}
+        changed, reused = {}, {}
+        for section, fields in extracted_data.items():
+            entry = self.sections.get(section)
+            if entry and entry.get("input_hash") == hashes[section]:
+                reused[section] = entry["output"]
+            else:
+                changed[section] = fields
+        return changed, reused, hashes
+
+    def update(self, section_data, hashes, errors=None):
+        # Failed sections are not stored so they are generated again next time
+        errors = errors or {}
+        now = datetime.now().isoformat(timespec="seconds")
+        for section, output in section_data.items():
+            if section in errors or section not in hashes or not isinstance(output, str):
+                continue
+            self.sections[section] = {"input_hash": hashes[section], "output": output, "updated_at": now}
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.sections, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def generate_changed_sections(extracted_data, generate, store_path, model, generation_mode="sections"):
+    """
+    Calls generate(changed_sections) -> (section_data, errors) only for sections whose inputs changed
+    since the last run, and merges the result with the stored outputs of the others.
+    With store_path None (nothing on disk to keep it next to) every section is generated.
+
+    Returns:
+        tuple: (section_data in extracted_data order, errors, number of skipped section calls)
+    """
+    if store_path is None:
+        generated, errors = generate(extracted_data) if extracted_data else ({}, {})
+        return {section: generated.get(section, "Missing") for section in extracted_data}, errors, 0
+
+    store = SectionStore(store_path)
+    changed, reused, hashes = store.partition(extracted_data, model, generation_mode)
+
+    generated, errors = generate(changed) if changed else ({}, {})
+    store.update(generated, hashes, errors)
+    store.save()
+
+    section_data = {section: generated.get(section, reused.get(section, "Missing")) for section in extracted_data}
+    return section_data, errors, len(reused)
+
+
+def report_skipped_sections(name, skipped, total):
+    if skipped:
+        print(f"♻️ {name}: reused {skipped}/{total} sections with unchanged inputs ({total - skipped} LLM calls)")
+
+
+def partition_batch(patients, store_paths, model, generation_mode="sections"):
+    """
+    Batch version of SectionStore.partition for section-major scheduling.
+
+    Args:
+        patients (dict): {patient_id: {section: fields}}
+        store_paths (dict): {patient_id: section store path}
+
+    Returns:
+        tuple: (stores, changed, reused, hashes) - each a dict keyed by patient_id.
+    """
+    stores, changed, reused, hashes = {}, {}, {}, {}
+    for patient_id, extracted_data in patients.items():
+        stores[patient_id] = SectionStore(store_paths[patient_id])
+        changed[patient_id], reused[patient_id], hashes[patient_id] = stores[patient_id].partition(extracted_data, model, generation_mode)
+    return stores, changed, reused, hashes
+
+
+def merge_batch(patients, stores, generated, reused, hashes, errors):
+    """
+    Stores the newly generated sections and returns {patient_id: section_data} in each patient's section order.
+    """
+    section_data = {}
+    for patient_id, extracted_data in patients.items():
+        stores[patient_id].update(generated.get(patient_id, {}), hashes[patient_id], errors.get(patient_id))
+        stores[patient_id].save()
+        section_data[patient_id] = {
+            section: generated.get(patient_id, {}).get(section, reused[patient_id].get(section, "Missing"))
+            for section in extracted_data
+        }
+    return section_data
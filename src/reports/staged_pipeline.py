@@ -0,0 +1,185 @@
+# ------------------------------------------------------------
+# Three-stage batch pipeline:
+#   1. extract  - PDF parsing / OCR in a process pool (CPU-bound)
+#   2. generate - LLM calls in a few threads (I/O-bound, bounded further by llm_limiter)
+#   3. render   - report rendering and writing in the calling thread
+# Stages are connected by bounded queues, so OCR of the next patients overlaps with the LLM calls
+# of the current ones while a fast stage can never run far ahead of a slow one.
+# ------------------------------------------------------------
+import time
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+_DONE = object()
+QUEUE_SAMPLE_SECONDS = 0.5
+
+
+class QueueMonitor:
+    """
+    Samples the depth of the stage queues in the background (max and mean per queue).
+    """
+
+    def __init__(self, queues, interval=QUEUE_SAMPLE_SECONDS):
+        self.queues = queues
+        self.interval = interval
+        self.samples = {name: [] for name in queues}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            for name, q in self.queues.items():
+                self.samples[name].append(q.qsize())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        return {
+            name: {"max": max(samples, default=0), "mean": sum(samples) / len(samples) if samples else 0.0}
+            for name, samples in self.samples.items()
+        }
+
+
+class StageTimer:
+    def __init__(self):
+        self.items = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds, failed=False):
+        with self._lock:
+            self.items += 1
+            self.failed += 1 if failed else 0
+            self.busy_seconds += seconds
+
+    def to_dict(self):
+        return {"items": self.items, "failed": self.failed, "busy_seconds": self.busy_seconds}
+
+
+def run_staged_pipeline(items, extract, generate, render, extract_workers, llm_workers, queue_size,
+                        initializer=None, initargs=()):
+    """
+    Runs every item through extract -> generate -> render.
+
+    Args:
+        items (list): Batch items (e.g. patient folders).
+        extract (callable): item -> extracted. Runs in a worker process, so it must be a module-level function.
+        generate (callable): (item, extracted) -> generated. Runs in one of llm_workers threads.
+        render (callable): (item, extracted, generated) -> result. Runs in the calling thread.
+        extract_workers (int): Processes of the extract stage.
+        llm_workers (int): Items in the generate stage at the same time.
+        queue_size (int): Capacity of each queue between stages.
+        initializer, initargs: Passed to the extract process pool.
+
+    Returns:
+        tuple: ({item: render result, or None if any stage failed}, stats)
+    """
+    extracted_q = queue.Queue(maxsize=queue_size)
+    generated_q = queue.Queue(maxsize=queue_size)
+    timers = {"extract": StageTimer(), "generate": StageTimer(), "render": StageTimer()}
+    results = {item: None for item in items}
+
+    def extract_stage():
+        try:
+            # At most extract_workers jobs in the pool: when extracted_q is full, put() blocks and OCR pauses
+            with ProcessPoolExecutor(max_workers=extract_workers, initializer=initializer, initargs=initargs) as executor:
+                remaining = iter(items)
+                pending = {}
+                exhausted = False
+                while pending or not exhausted:
+                    while not exhausted and len(pending) < extract_workers:
+                        item = next(remaining, _DONE)
+                        if item is _DONE:
+                            exhausted = True
+                        else:
+                            pending[executor.submit(timed_call, extract, item)] = item
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        item = pending.pop(future)
+                        try:
+                            extracted, seconds = future.result()
+                            timers["extract"].add(seconds)
+                            extracted_q.put((item, extracted))
+                        except Exception as e:
+                            timers["extract"].add(0.0, failed=True)
+                            print(f"❌ Extraction failed for {item}: {e}")
+        except Exception as e:
+            print(f"❌ Extract stage stopped: {e}")
+        finally:
+            # Always release the generate stage, even when the pool broke
+            for _ in range(llm_workers):
+                extracted_q.put(_DONE)
+
+    def generate_stage():
+        while True:
+            entry = extracted_q.get()
+            if entry is _DONE:
+                return
+            item, extracted = entry
+            start = time.time()
+            try:
+                generated_q.put((item, extracted, generate(item, extracted)))
+                timers["generate"].add(time.time() - start)
+            except Exception as e:
+                timers["generate"].add(time.time() - start, failed=True)
+                print(f"❌ Generation failed for {item}: {e}")
+
+    def close_generate_stage(threads):
+        for thread in threads:
+            thread.join()
+        generated_q.put(_DONE)
+
+    start = time.time()
+    with QueueMonitor({"extracted": extracted_q, "generated": generated_q}) as monitor:
+        extractor = threading.Thread(target=extract_stage, daemon=True)
+        generators = [threading.Thread(target=generate_stage, daemon=True) for _ in range(llm_workers)]
+        closer = threading.Thread(target=close_generate_stage, args=(generators,), daemon=True)
+        for thread in [extractor, *generators, closer]:
+            thread.start()
+
+        while True:
+            entry = generated_q.get()
+            if entry is _DONE:
+                break
+            item, extracted, generated = entry
+            render_start = time.time()
+            try:
+                results[item] = render(item, extracted, generated)
+                timers["render"].add(time.time() - render_start)
+            except Exception as e:
+                timers["render"].add(time.time() - render_start, failed=True)
+                print(f"❌ Rendering failed for {item}: {e}")
+        extractor.join()
+
+    stats = {
+        "seconds": time.time() - start,
+        "stages": {name: timer.to_dict() for name, timer in timers.items()},
+        "queues": monitor.summary(),
+    }
+    return results, stats
+
+
+def timed_call(func, item):
+    start = time.time()
+    return func(item), time.time() - start
+
+
+def report_pipeline_stats(stats):
+    print(f"🧵 Pipeline finished in {stats['seconds']:.2f} seconds")
+    for name, stage in stats["stages"].items():
+        utilization = stage["busy_seconds"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+        print(f"   {name:<9} {stage['items']} items ({stage['failed']} failed), "
+              f"{stage['busy_seconds']:.2f}s busy ({utilization:.0%} of wall time, summed over workers)")
+    for name, depth in stats["queues"].items():
+        print(f"   queue '{name}': max depth {depth['max']}, mean {depth['mean']:.2f}")
@@ -2,25 +2,270 @@ import streamlit as st
 import time
 import multiprocessing
 from pathlib import Path
-import tempfile
-import os
-import shutil
+import uuid
+import queue
 
 # -----------------------------
 # Your existing process_pdf
 # -----------------------------
-from main_multiprocess import process_pdf
+from main_multiprocess import process_pdf_with_events, document_report_key, effective_mode, TARGET_SECTIONS, STREAM_SECTIONS, GENERATION_MODE
+from extract_neuropsych_form import extract_pdf_form_data, extract_sections, load_field_to_section_map
+from ai_configuration_local import stream_local_response
+from section_runner import stream_sections, collect_section_events
+from report_renderer import render_summary_html
+from patient_details import get_patient_info
+from llm_limiter import create_llm_semaphores, init_llm_limiter
+from worker_pool import SharedWorkerPool, warm_worker
+from report_store import content_hash, get_stored_report, store_report, group_by_content
 
 
 # -----------------------------
-# Helper to save uploaded PDFs
+# Uploads stay in memory: (content hash, file name, PDF bytes)
 # -----------------------------
-def save_uploaded_file(uploaded_file):
-    temp_dir = tempfile.mkdtemp()
-    temp_path = os.path.join(temp_dir, uploaded_file.name)
-    with open(temp_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-    return temp_path, temp_dir  # return dir to clean up later
+def read_uploads(uploaded_files):
+    uploads = []
+    for f in uploaded_files:
+        pdf_bytes = f.getvalue()
+        uploads.append((content_hash(pdf_bytes), f.name, pdf_bytes))
+    return uploads
+
+# -----------------------------
+# One warm pool for the whole app (all sessions, all clicks)
+# -----------------------------
+@st.cache_resource
+def get_llm_semaphores():
+    # One set of LLM request slots for the pool workers and the live preview in this process
+    semaphores = create_llm_semaphores()
+    init_llm_limiter(semaphores)
+    return semaphores
+
+@st.cache_resource
+def get_worker_pool():
+    return SharedWorkerPool(
+        processes=multiprocessing.cpu_count(),
+        initializer=warm_worker,
+        initargs=(get_llm_semaphores(),)
+    )
+
+@st.cache_resource
+def get_event_manager():
+    # Owns the queues workers publish section events to
+    return multiprocessing.Manager()
+
+def get_session_id():
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    return st.session_state.session_id
+
+# -----------------------------
+# Live preview: stream each section into the page as it is generated
+# -----------------------------
+TOKEN_REFRESH_SECONDS = 0.25  # Throttle re-rendering of partial sections
+
+def process_pdf_live(file_name, pdf_bytes):
+    """
+    Returns:
+        tuple: (name, html_content, section errors)
+    """
+    get_llm_semaphores()  # Streams under the same machine-wide request limit as the pool workers
+    name = Path(file_name).with_suffix(".html").name
+    filled_values = extract_pdf_form_data(pdf_bytes)
+    extracted_data = extract_sections(filled_values, TARGET_SECTIONS, load_field_to_section_map())
+
+    st.markdown(f"### {name}")
+    placeholders = {section: st.empty() for section in extracted_data}
+    last_refresh = {}
+
+    def on_event(event):
+        section = event["section"]
+        placeholder = placeholders[section]
+        if event["type"] == "token":
+            now = time.time()
+            if now - last_refresh.get(section, 0) < TOKEN_REFRESH_SECONDS:
+                return
+            last_refresh[section] = now
+            placeholder.markdown(f"**{section}** _(generating…)_\n\n{event['text']}")
+        elif event["type"] == "section":
+            stats = event["stats"]
+            ttft = f"{stats['ttft']:.2f}s" if stats["ttft"] is not None else "n/a"
+            placeholder.markdown(f"**{section}** _(first token {ttft}, done in {stats['seconds']:.2f}s)_\n\n{event['text']}")
+        else:
+            placeholder.warning(f"{section}: {event['error']['message']}")
+
+    section_data, errors, _stats = collect_section_events(
+        stream_sections(extracted_data, stream_local_response), extracted_data, on_event=on_event
+    )
+    html_content = render_summary_html(section_data, None, get_patient_info(filled_values), TARGET_SECTIONS)
+    return name, html_content, errors
+
+def process_pdfs_live(uploads, progress, status_text):
+    """
+    Streams the PDFs one after another. Like process_pdfs_progressive, identical uploads are
+    generated once and documents processed before show their stored report.
+
+    Returns:
+        list: [(name, html_content)] of the PDFs that were processed.
+    """
+    unique, duplicates, _ = group_by_content(range(len(uploads)), lambda i: uploads[i][0])
+    for copy, original in duplicates.items():
+        st.caption(f"{uploads[copy][1]} is identical to {uploads[original][1]}: processed once")
+
+    reports = {}  # content hash -> html
+    for n, i in enumerate(unique, 1):
+        doc_hash, file_name, pdf_bytes = uploads[i]
+        # Streaming always makes one call per section
+        key = document_report_key(doc_hash, effective_mode(True, GENERATION_MODE))
+        stored = get_stored_report(key)
+        if stored is not None:
+            reports[doc_hash] = stored
+            st.caption(f"{file_name} was processed before: showing its stored report")
+        else:
+            try:
+                _, html_content, errors = process_pdf_live(file_name, pdf_bytes)
+                reports[doc_hash] = html_content
+                if not errors:
+                    store_report(key, html_content)
+            except Exception as e:
+                print(f"❌ Live preview failed for {file_name}: {e}")
+                st.error(f"Failed to process {file_name}")
+        progress.progress(n / len(unique))
+        status_text.text(f"Processed {n}/{len(unique)} PDFs")
+
+    # One entry per upload, duplicates included, under each upload's own name
+    return [
+        (Path(file_name).with_suffix(".html").name, reports[doc_hash])
+        for doc_hash, file_name, _ in uploads if doc_hash in reports
+    ]
+
+# -----------------------------
+# Progressive report view: sections appear as soon as their LLM call completes
+# -----------------------------
+EVENT_POLL_SECONDS = 0.2  # Also the refresh rate of the live section timers
+
+class ReportView:
+    """
+    Placeholders for the sections of one PDF, filled in from worker events.
+    """
+
+    def __init__(self, file_name):
+        st.markdown(f"### {Path(file_name).with_suffix('.html').name}")
+        self.container = st.container()
+        self.placeholders = {}
+        self.done = set()
+        self.started = None
+
+    def start(self, sections):
+        self.started = time.time()
+        for section in sections:
+            self.placeholders[section] = self.container.empty()
+        self.tick()
+
+    def tick(self):
+        # Live timer for the sections still being generated
+        if self.started is None:
+            return
+        elapsed = time.time() - self.started
+        for section, placeholder in self.placeholders.items():
+            if section not in self.done:
+                placeholder.markdown(f"**{section}** _(generating… {elapsed:.1f}s)_")
+
+    def show(self, event):
+        section = event["section"]
+        if section not in self.placeholders:
+            self.placeholders[section] = self.container.empty()
+        self.done.add(section)
+        seconds = event.get("stats", {}).get("seconds")
+        timing = f"done in {seconds:.2f}s" if seconds is not None else "done"
+        if event["type"] == "section":
+            self.placeholders[section].markdown(f"**{section}** _({timing})_\n\n{event['text']}")
+        else:
+            self.placeholders[section].warning(f"{section}: {event['error']['message']}")
+
+def handle_event(views, event):
+    view = views.get(event["pdf"])
+    if view is None:
+        return
+    if event["type"] == "start":
+        view.start(event["sections"])
+    elif event["type"] in ("section", "error"):
+        view.show(event)
+
+def drain_events(events, views, timeout):
+    try:
+        event = events.get(timeout=timeout)
+        while True:
+            handle_event(views, event)
+            event = events.get_nowait()
+    except queue.Empty:
+        pass
+
+def process_pdfs_progressive(uploads, progress, status_text):
+    """
+    Runs the PDFs on the shared pool and fills in each report section by section.
+    Identical uploads share one job, and documents processed before return their stored report.
+    Uploads stay in memory, so they have no section store: a changed upload regenerates every
+    section (unchanged-section reuse only applies to batch runs on files).
+
+    Returns:
+        list: [(name, html_content)] of the PDFs that were processed.
+    """
+    pool = get_worker_pool()
+    events = get_event_manager().Queue()
+
+    unique, duplicates, _ = group_by_content(range(len(uploads)), lambda i: uploads[i][0])
+    for copy, original in duplicates.items():
+        st.caption(f"{uploads[copy][1]} is identical to {uploads[original][1]}: processed once")
+
+    reports = {}  # content hash -> html
+    for i in unique:
+        doc_hash, file_name, _ = uploads[i]
+        stored = get_stored_report(document_report_key(doc_hash, effective_mode(STREAM_SECTIONS, GENERATION_MODE)))
+        if stored is not None:
+            reports[doc_hash] = stored
+            st.caption(f"{file_name} was processed before: showing its stored report")
+
+    to_process = [uploads[i] for i in unique if uploads[i][0] not in reports]
+    views = {doc_hash: ReportView(file_name) for doc_hash, file_name, _ in to_process}
+
+    # Shared warm pool: jobs of all sessions are served round-robin
+    futures = {}
+    for doc_hash, file_name, pdf_bytes in to_process:
+        try:
+            future = pool.submit(get_session_id(), process_pdf_with_events, pdf_bytes, events,
+                                 STREAM_SECTIONS, GENERATION_MODE, file_name, doc_hash)
+            futures[future] = (doc_hash, file_name)
+        except queue.Full:
+            st.warning(f"Server busy, {file_name} was not queued. Please retry in a moment.")
+    if pool.pending() > len(futures):
+        status_text.text(f"Queued behind {pool.pending() - len(futures)} jobs from other sessions...")
+
+    remaining = set(futures)
+    while remaining:
+        drain_events(events, views, EVENT_POLL_SECONDS)
+        for view in views.values():
+            view.tick()
+        for future in [future for future in remaining if future.done()]:
+            remaining.discard(future)
+            doc_hash, file_name = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = None
+                print(f"❌ Worker error for {file_name}: {e}")
+            if result:
+                reports[doc_hash] = result[1]
+            else:
+                st.error(f"Failed to process {file_name}")
+            done = len(futures) - len(remaining)
+            progress.progress(done / len(futures))
+            status_text.text(f"Processed {done}/{len(futures)} PDFs")
+    drain_events(events, views, 0)
+
+    # One entry per upload, duplicates included, under each upload's own name
+    return [
+        (Path(file_name).with_suffix(".html").name, reports[doc_hash])
+        for doc_hash, file_name, _ in uploads if doc_hash in reports
+    ]
 
 # -----------------------------
 # Streamlit App
@@ -31,27 +276,29 @@ def main():
     uploaded_files = st.file_uploader(
         "Upload one or more PDFs", 
         type=["pdf"], 
-        accept_multiple_files=True
+        accept_multiple_files=True,
+        help="A PDF identical to one processed before shows its stored report. "
+             "Any other upload generates every section again, even if only part of the form changed."
     )
 
+    live_preview = st.checkbox("Live preview (stream sections as they are generated)")
+
     if uploaded_files and st.button("Process PDFs"):
         total_start = time.time()
-        saved_files = [save_uploaded_file(f) for f in uploaded_files]
-        pdf_paths = [f[0] for f in saved_files]
-        temp_dirs = [f[1] for f in saved_files]  # for cleanup later
+        uploads = read_uploads(uploaded_files)
 
-        st.info(f"Found {len(pdf_paths)} PDFs. Processing...")
+        st.info(f"Found {len(uploads)} PDFs. Processing...")
 
         progress = st.progress(0)
         status_text = st.empty()
         processed_html_contents = []
 
-        # Multiprocessing
-        with multiprocessing.Pool(processes=multiprocessing.cpu_count()) as pool:
-            for i, (name, html_content) in enumerate(pool.imap_unordered(process_pdf, pdf_paths), 1):
-                progress.progress(i / len(pdf_paths))
-                status_text.text(f"Processed {i}/{len(pdf_paths)} PDFs")
-                processed_html_contents.append((name, html_content))
+        if live_preview:
+            # Sections of each PDF stream into the page; PDFs are handled one after another
+            processed_html_contents = process_pdfs_live(uploads, progress, status_text)
+        else:
+            # Sections of every PDF appear as soon as they are generated
+            processed_html_contents = process_pdfs_progressive(uploads, progress, status_text)
 
         total_elapsed = time.time() - total_start
         st.success(f"🏁 All PDFs processed in {total_elapsed:.2f} seconds.")
@@ -67,9 +314,6 @@ def main():
                     file_name=name,
                     mime="text/html"
                 )
-            
-        # # Cleanup temp dirs safely
-        st.session_state.temp_dirs = temp_dirs
 
 if __name__ == "__main__":
     main()
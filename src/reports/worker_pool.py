@@ -0,0 +1,133 @@
+# ------------------------------------------------------------
+# One pre-warmed process pool shared by every session of the Streamlit app.
+# Workers import the pipeline modules and load the field mapping, report template and HTTP/Groq
+# clients once, when the pool starts, instead of on every "Process PDFs" click.
+# Jobs from all sessions wait in a bounded queue and are handed to the pool round-robin across
+# sessions, so one clinician's large upload cannot starve another's single PDF.
+# ------------------------------------------------------------
+import os
+import queue
+import atexit
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from llm_limiter import init_llm_limiter
+
+# Jobs waiting for a worker, across all sessions
+MAX_QUEUED_JOBS = int(os.getenv("NHORA_MAX_QUEUED_JOBS", "200"))
+
+
+def warm_worker(semaphores):
+    """
+    Pool initializer: installs the shared LLM limiter and loads everything a job needs.
+    """
+    init_llm_limiter(semaphores)
+
+    from extract_neuropsych_form import load_field_to_section_map
+    from report_renderer import get_report_template
+    from ai_configuration_local import get_http_session
+    import ai_configuration_remote  # Creates the Groq client
+    import main_multiprocess  # Pipeline entry points (process_pdf, ...)
+
+    load_field_to_section_map()
+    get_report_template()
+    get_http_session()
+
+
+class SharedWorkerPool:
+    """
+    multiprocessing.Pool behind a fair, bounded job queue.
+
+    Args:
+        processes (int): Worker processes.
+        max_queued (int): Jobs allowed to wait for a worker; submit() raises queue.Full beyond that.
+        initializer, initargs: Passed to multiprocessing.Pool.
+    """
+
+    def __init__(self, processes, max_queued=MAX_QUEUED_JOBS, initializer=None, initargs=()):
+        self.processes = processes
+        self.max_queued = max_queued
+        self._pool = multiprocessing.Pool(processes=processes, initializer=initializer, initargs=initargs)
+        self._sessions = OrderedDict()  # session_id -> deque of (future, func, args), in round-robin order
+        self._queued = 0
+        self._running = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self._dispatcher.start()
+        atexit.register(self.close)
+
+    def submit(self, session_id, func, *args):
+        """
+        Queues func(*args) for a session. func must be importable by the workers (module-level).
+
+        Returns:
+            concurrent.futures.Future: Resolved with the job's result or exception.
+        """
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Worker pool is closed")
+            if self._queued >= self.max_queued:
+                raise queue.Full(f"{self._queued} jobs already waiting")
+            self._sessions.setdefault(session_id, deque()).append((future, func, args))
+            self._queued += 1
+            self._cond.notify_all()
+        return future
+
+    def pending(self, session_id=None):
+        with self._cond:
+            if session_id is None:
+                return self._queued
+            return len(self._sessions.get(session_id, ()))
+
+    def _next_job(self):
+        # Takes one job from the session at the front, then moves that session to the back
+        session_id, jobs = next(iter(self._sessions.items()))
+        job = jobs.popleft()
+        self._sessions.pop(session_id)
+        if jobs:
+            self._sessions[session_id] = jobs
+        self._queued -= 1
+        return job
+
+    def _dispatch(self):
+        # Only hand a job to the pool when a worker is free: the pool's own queue is FIFO and would undo the fairness
+        while True:
+            with self._cond:
+                while not self._closed and (not self._queued or self._running >= self.processes):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                future, func, args = self._next_job()
+                if not future.set_running_or_notify_cancel():
+                    continue  # Cancelled while queued
+                self._running += 1
+            self._pool.apply_async(
+                func, args,
+                callback=lambda result, future=future: self._finish(future, result=result),
+                error_callback=lambda error, future=future: self._finish(future, error=error),
+            )
+
+    def _finish(self, future, result=None, error=None):
+        with self._cond:
+            self._running -= 1
+            self._cond.notify_all()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            for jobs in self._sessions.values():
+                for future, _, _ in jobs:
+                    future.cancel()
+            self._sessions.clear()
+            self._queued = 0
+            self._cond.notify_all()
+        self._pool.terminate()